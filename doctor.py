@@ -1,21 +1,2297 @@
+import time
+_startup_clock = time.perf_counter()
 import tkinter as tk
 from tkinter import scrolledtext, messagebox, ttk, filedialog
-from PIL import Image, ImageTk
-from translate import Translator
-import pyttsx3
-import speech_recognition as sr
 import re
 import sqlite3
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import importlib
 import os
-from datetime import datetime
+import sys
+import io
+from datetime import datetime, timedelta
 import logging
-import colorsys
+import logging.handlers
+import base64
+import secrets
+import atexit
+import hashlib
+import json
+import html
+import threading
+import itertools
+import functools
+import math
+import marshal
+import queue
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from contextlib import contextmanager, nullcontext
+
+# Seconds spent per startup component; see startup_report()
+STARTUP_TIMINGS = OrderedDict()
+STARTUP_TIMINGS["import core modules"] = time.perf_counter() - _startup_clock
+
+class LazyModule:
+    # Stands in for a heavy module and imports it on first attribute access, so the login window
+    # does not wait for PDF, speech, imaging or translation libraries that a session may never use
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            STARTUP_TIMINGS[f"import {self._name}"] = time.perf_counter() - start
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+# Loaded on first use: PIL and numpy on the first upload, speech_recognition on the first mic
+# press, pyttsx3 on the first spoken message, translate on the first non-English prompt and
+# reportlab on the first export
+Image = LazyModule("PIL.Image")
+np = LazyModule("numpy")
+sr = LazyModule("speech_recognition")
+pyttsx3 = LazyModule("pyttsx3")
+translate = LazyModule("translate")
+canvas = LazyModule("reportlab.pdfgen.canvas")
+pdfmetrics = LazyModule("reportlab.pdfbase.pdfmetrics")
+LETTER_PAGE_SIZE = (612.0, 792.0)  # reportlab.lib.pagesizes.letter, in points
+# Standard modules needed only by the command line, the intake server, exports and benchmarks
+asyncio = LazyModule("asyncio")
+argparse = LazyModule("argparse")
+zipfile = LazyModule("zipfile")
+tempfile = LazyModule("tempfile")
+futures_process = LazyModule("concurrent.futures.process")
+
+# Logging goes through a queue to a background writer thread, so the UI never waits on the log
+# file. Override these with environment variables.
+LOG_FILE = os.environ.get("MEDIBOT_LOG_FILE", "chatbot_errors.log")
+LOG_LEVEL = os.environ.get("MEDIBOT_LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.environ.get("MEDIBOT_LOG_MAX_BYTES", 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("MEDIBOT_LOG_BACKUPS", 3))
+LOG_DEBUG_SAMPLE = int(os.environ.get("MEDIBOT_LOG_DEBUG_SAMPLE", 10))  # keep 1 in N debug records per call site
+LOG_QUEUE_SIZE = 10000
+
+class DebugSampler(logging.Filter):
+    # Passes the first and then every Nth DEBUG record from each call site; other levels always pass
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self.counts = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        key = (record.pathname, record.lineno)
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        return count % self.every == 0
+
+class BackgroundLogHandler(logging.handlers.QueueHandler):
+    # Hands records to the writer thread without blocking; when the queue is full they are dropped
+    # and counted instead
+    def __init__(self, log_queue, target):
+        super().__init__(log_queue)
+        self.target = target
+        self.pid = os.getpid()
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if os.getpid() != self.pid:
+            # Forked worker processes have no writer thread, so they write directly
+            self.target.handle(record)
+            return
+        super().emit(record)
+
+_log_listener = None
+
+def configure_logging(level=None, filename=None):
+    global _log_listener
+    stop_logging()
+    file_handler = logging.handlers.RotatingFileHandler(filename or LOG_FILE, maxBytes=LOG_MAX_BYTES,
+                                                        backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    handler = BackgroundLogHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE), file_handler)
+    handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE))
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    try:
+        root.setLevel(str(level or LOG_LEVEL).upper())
+    except ValueError:
+        root.setLevel(logging.INFO)
+    _log_listener = logging.handlers.QueueListener(handler.queue, file_handler)
+    _log_listener.start()
+    return handler
+
+def stop_logging():
+    # Write out everything still queued and close the file
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+configure_logging()
+atexit.register(stop_logging)
+
+# Diagnostic questions
+QUESTIONS = {
+    "age_group": "Is the patient a child (under 18) or an adult? Please respond with 'child' or 'adult'.",
+    "vitals": "Please provide any known vital signs (e.g., temperature in °F, heart rate in bpm). Enter 'unknown' if not available.",
+    "initial": "Please describe the patient's symptoms in detail.",
+    "duration": "How long have the symptoms been present?",
+    "allergies": "Does the patient have any known allergies or pre-existing conditions?",
+    "history": "Has the patient experienced similar symptoms before?",
+    "lifestyle": "Can you provide details about the patient's diet, exercise, or recent travel?",
+    "follow_up": "Please answer the following symptom-specific question: ",
+    "final": "Thank you for the information. I will generate a prescription based on the responses."
+}
+
+# Follow-up question templates (including skin conditions)
+FOLLOW_UP_TEMPLATES = {
+    "fever": ["Is the fever accompanied by a rash?", "Do you have chills or night sweats?"],
+    "cough": ["Is the cough dry or productive (with phlegm)?", "Is the cough worse at night?"],
+    "headache": ["Is the headache accompanied by nausea or sensitivity to light?", "Does it feel like a throbbing pain?"],
+    "diarrhea": ["Is there blood in the stool?", "Are you experiencing dehydration symptoms like dizziness?"],
+    "rash": ["Is the rash itchy?", "Does it spread or change in appearance?"],
+    "eczema": ["Is the skin dry or cracked?", "Is there oozing or crusting?"],
+    "psoriasis": ["Are there thick, scaly patches?", "Is it painful or itchy?"],
+    "acne": ["Is the acne inflamed or pustular?", "Does it appear on the face, back, or chest?"]
+}
+
+# Follow-up questions answered by picking an option rather than yes or no, with the answers
+# constrained speech recognition listens for; every other follow-up question is yes/no
+FOLLOW_UP_CHOICES = {
+    "Is the cough dry or productive (with phlegm)?": ["dry", "productive", "phlegm"],
+    "Is the skin dry or cracked?": ["dry", "cracked", "both"],
+    "Is it painful or itchy?": ["painful", "itchy", "both"],
+    "Is the acne inflamed or pustular?": ["inflamed", "pustular", "both"],
+    "Does it appear on the face, back, or chest?": ["face", "back", "chest"]
+}
+
+SERIOUS_SYMPTOMS = ["chest pain", "difficulty breathing", "severe abdominal pain", "unconsciousness", "severe bleeding", "severe skin infection"]
+
+# Order in which the intake questions are asked
+STATE_ORDER = ["age_group", "vitals", "initial", "follow_up", "duration", "allergies", "history", "lifestyle", "final"]
+
+# Words in a symptom description that point to a skin condition, checked in this order
+SKIN_KEYWORDS = {
+    "psoriasis": ["scaly", "scale"],
+    "eczema": ["dry", "cracked"],
+    "acne": ["pimple", "acne"]
+}
+
+# Answers that are kept in user_profiles between sessions
+PROFILE_FIELDS = ["allergies", "history", "lifestyle"]
+
+SEVERITY_LEVELS = {1: "mild", 2: "moderate", 3: "severe"}
+
+# Prescriptions shown per page of the history tab
+HISTORY_PAGE_SIZE = 20
+
+PRESCRIPTION_DISCLAIMER = ("These are suggested prescriptions. Consult a qualified doctor to confirm dosages and appropriateness. "
+                           "This chatbot is not a substitute for professional medical advice.")
+
+# Bump when the layout of IntakeSession.to_bytes() changes; older records are then ignored
+SESSION_RECORD_VERSION = 1
+
+# Fixed doctor messages shown during an intake; translated like the questions
+RESULT_MESSAGES = {
+    "age_group_invalid": "Please specify 'child' or 'adult'.",
+    "error": "An error occurred. Please try again or reset the chat.",
+    "listening": "Listening...",
+    "speech_unclear": "Sorry, I couldn't understand. Please try again.",
+    "speech_unavailable": "Sorry, the speech recognition service is unavailable.",
+    "image_failed": "Failed to load image. Please try again with a valid image file.",
+    "prescription_ready": "Prescription generated and displayed in a new window.",
+    "prescription_failed": "Failed to generate prescription. Please try again.",
+    "session_resumed": "Welcome back. Continuing your previous consultation where you left off."
+}
+
+# Languages offered in the language selector, name -> translation code
+LANGUAGES = {
+    'Arabic': 'ar',
+    'Assamese': 'as',
+    'Bengali': 'bn',
+    'Bodo': 'brx',
+    'Chinese (Simplified)': 'zh-cn',
+    'Danish': 'da',
+    'Dutch': 'nl',
+    'English': 'en',
+    'Finnish': 'fi',
+    'French': 'fr',
+    'German': 'de',
+    'Greek': 'el',
+    'Gujarati': 'gu',
+    'Hebrew': 'he',
+    'Hindi': 'hi',
+    'Indonesian': 'id',
+    'Italian': 'it',
+    'Japanese': 'ja',
+    'Kannada': 'kn',
+    'Kashmiri': 'ks',
+    'Konkani': 'kok',
+    'Korean': 'ko',
+    'Maithili': 'mai',
+    'Malayalam': 'ml',
+    'Manipuri/Meitei': 'mni',
+    'Marathi': 'mr',
+    'Nepali': 'ne',
+    'Odia': 'or',
+    'Polish': 'pl',
+    'Portuguese': 'pt',
+    'Punjabi': 'pa',
+    'Russian': 'ru',
+    'Sanskrit': 'sa',
+    'Santali': 'sat',
+    'Sindhi': 'sd',
+    'Spanish': 'es',
+    'Swahili': 'sw',
+    'Swedish': 'sv',
+    'Tamil': 'ta',
+    'Telugu': 'te',
+    'Thai': 'th',
+    'Turkish': 'tr',
+    'Urdu': 'ur',
+    'Vietnamese': 'vi'
+}
+
+# Bump when the conditions table layout changes; together with the content hash it decides reseeding
+KB_SCHEMA_VERSION = 2
+
+CONDITIONS_SCHEMA = '''
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        symptom TEXT,
+        age_group TEXT,
+        severity TEXT,
+        treatment TEXT,
+        description TEXT,
+        severity_info TEXT,
+        causes TEXT,
+        prevention TEXT
+    )
+'''
+
+SAMPLE_CONDITIONS = [
+    ("fever", "fever", "adult", "mild", "Acetaminophen 500mg every 6 hours as needed (max 3g daily).", 
+     "Fever is a temporary increase in body temperature above the normal range.", 
+     "Mild to Moderate", "Viral or bacterial infections", "Stay hydrated, rest"),
+    ("fever", "fever", "adult", "moderate", "Ibuprofen 400mg every 6 hours as needed (max 3.2g daily).", 
+     "Fever is a temporary increase in body temperature above the normal range.", 
+     "Moderate to Severe", "Infections or inflammation", "Monitor temperature, seek doctor if persistent"),
+    ("fever", "fever", "adult", "severe", "Seek medical attention if fever exceeds 103°F or persists beyond 3 days.", 
+     "Fever is a temporary increase in body temperature above the normal range.", 
+     "Severe", "Serious infections", "Immediate medical consultation"),
+    ("fever", "fever", "child", "mild", "Acetaminophen 10-15mg/kg every 6 hours as needed (max 75mg/kg daily).", 
+     "Fever in children often indicates an immune response to infection.", 
+     "Mild", "Viral infections", "Ensure hydration, monitor temperature"),
+    ("fever", "fever", "child", "moderate", "Acetaminophen 10-15mg/kg every 6 hours. Consult pediatrician if persistent.", 
+     "Fever in children often indicates an immune response to infection.", 
+     "Moderate", "Bacterial infections", "Consult pediatrician if persistent"),
+    ("fever", "fever", "child", "severe", "Seek pediatrician immediately if fever exceeds 102°F or lasts over 24 hours.", 
+     "Fever in children often indicates an immune response to infection.", 
+     "Severe", "Serious infections", "Immediate pediatric consultation"),
+
+    ("cough", "cough", "adult", "mild", "Dextromethorphan 10-20mg every 4 hours as needed.", 
+     "Cough is a reflex to clear the airways of irritants or mucus.", 
+     "Mild", "Cold or allergies", "Stay hydrated, avoid irritants"),
+    ("cough", "cough", "child", "mild", "Honey (for ages 1+), 1-2 tsp at bedtime.", 
+     "Cough in children can be due to viral infections or irritants.", 
+     "Mild", "Viral infections", "Use a humidifier, avoid smoke"),
+
+    ("headache", "headache", "adult", "mild", "Ibuprofen 200-400mg every 6 hours as needed (max 3.2g daily).", 
+     "Headache is pain in the head, often due to tension or dehydration.", 
+     "Mild to Moderate", "Stress or dehydration", "Stay hydrated, reduce stress"),
+    ("headache", "headache", "child", "mild", "Acetaminophen 10-15mg/kg every 6 hours as needed.", 
+     "Headache in children may be due to fatigue or minor infections.", 
+     "Mild", "Fatigue or infections", "Ensure rest, monitor symptoms"),
+
+    ("diarrhea", "diarrhea", "adult", "mild", "Loperamide 2mg after each loose stool (max 8mg daily).", 
+     "Diarrhea involves frequent loose or watery stools.", 
+     "Mild to Moderate", "Food poisoning or viral infection", "Stay hydrated, eat bland foods"),
+    ("diarrhea", "diarrhea", "child", "mild", "Oral rehydration solution (e.g., Pedialyte), 50-100mL/kg over 4 hours.", 
+     "Diarrhea in children can lead to dehydration if not managed.", 
+     "Mild", "Viral infections", "Use oral rehydration, avoid sugary drinks"),
+
+    ("rash", "rash", "adult", "mild", "Hydrocortisone cream 1% applied 2-3 times daily for 7 days.", 
+     "Rash is an area of irritated or swollen skin, often itchy.", 
+     "Mild", "Allergic reaction", "Avoid irritants, keep skin clean"),
+    ("rash", "rash", "adult", "moderate", "Clotrimazole cream 1% applied twice daily for 2 weeks; consult doctor if no improvement.", 
+     "Rash is an area of irritated or swollen skin, often itchy.", 
+     "Moderate", "Fungal infection", "Keep area dry, consult doctor if persistent"),
+    ("rash", "rash", "adult", "severe", "Prednisone 20mg daily for 5 days under medical supervision; seek dermatologist immediately.", 
+     "Rash is an area of irritated or swollen skin, often itchy.", 
+     "Severe", "Severe allergic reaction", "Seek medical attention"),
+    ("rash", "rash", "child", "mild", "Hydrocortisone cream 0.5% applied once daily for 5 days; consult pediatrician.", 
+     "Rash in children can be due to allergies or infections.", 
+     "Mild", "Allergic reaction", "Use hypoallergenic products, consult pediatrician"),
+    ("rash", "rash", "child", "moderate", "Hydrocortisone cream 0.5% applied twice daily for 7 days; consult pediatrician if persistent.", 
+     "Rash in children can be due to allergies or infections.", 
+     "Moderate", "Eczema flare-up", "Keep skin moisturized, avoid triggers"),
+    ("rash", "rash", "child", "severe", "Seek pediatrician immediately if rash spreads or worsens.", 
+     "Rash in children can be due to allergies or infections.", 
+     "Severe", "Infection or severe allergy", "Immediate medical consultation"),
+
+    ("eczema", "eczema", "adult", "mild", "Moisturize with Cetaphil twice daily; apply Hydrocortisone 1% as needed for 7 days.", 
+     "Eczema causes dry, itchy, and inflamed skin patches.", 
+     "Mild", "Dry skin or irritants", "Moisturize regularly, avoid harsh soaps"),
+    ("eczema", "eczema", "adult", "moderate", "Apply Tacrolimus ointment 0.1% twice daily for 2 weeks; consult dermatologist if no relief.", 
+     "Eczema causes dry, itchy, and inflamed skin patches.", 
+     "Moderate", "Chronic irritation", "Use fragrance-free products, consult dermatologist"),
+    ("eczema", "eczema", "adult", "severe", "Prednisone 20mg daily for 5 days under medical supervision; seek dermatologist immediately.", 
+     "Eczema causes dry, itchy, and inflamed skin patches.", 
+     "Severe", "Infection or severe flare-up", "Seek medical attention"),
+    ("eczema", "eczema", "child", "mild", "Moisturize with fragrance-free lotion twice daily; apply Hydrocortisone 0.5% as needed for 5 days.", 
+     "Eczema in children often appears as itchy patches.", 
+     "Mild", "Dry skin or allergens", "Use gentle skincare, avoid triggers"),
+    ("eczema", "eczema", "child", "moderate", "Moisturize with fragrance-free lotion; apply Tacrolimus ointment 0.03% twice daily for 7 days; consult pediatrician.", 
+     "Eczema in children often appears as itchy patches.", 
+     "Moderate", "Chronic irritation", "Keep skin hydrated, consult pediatrician"),
+    ("eczema", "eczema", "child", "severe", "Apply wet wrap therapy with Hydrocortisone 0.5% twice daily for 3 days; seek pediatrician if infection occurs.", 
+     "Eczema in children often appears as itchy patches.", 
+     "Severe", "Infection or severe flare-up", "Immediate pediatric consultation"),
+
+    ("psoriasis", "psoriasis", "adult", "mild", "Apply Coal tar ointment 2% nightly for 14 days; use moisturizer daily.", 
+     "Psoriasis causes thick, scaly patches on the skin.", 
+     "Mild", "Autoimmune response", "Moisturize, avoid stress"),
+    ("psoriasis", "psoriasis", "adult", "moderate", "Apply Calcipotriene ointment 0.005% twice daily for 4 weeks; consult dermatologist.", 
+     "Psoriasis causes thick, scaly patches on the skin.", 
+     "Moderate", "Chronic condition", "Use prescribed treatments, consult dermatologist"),
+    ("psoriasis", "psoriasis", "adult", "severe", "Methotrexate 7.5mg weekly under medical supervision; seek dermatologist immediately.", 
+     "Psoriasis causes thick, scaly patches on the skin.", 
+     "Severe", "Severe autoimmune flare-up", "Seek medical attention"),
+    ("psoriasis", "psoriasis", "child", "mild", "Apply Coal tar ointment 1% nightly for 7 days; use fragrance-free moisturizer daily.", 
+     "Psoriasis in children presents as scaly patches.", 
+     "Mild", "Genetic predisposition", "Moisturize, avoid irritants"),
+    ("psoriasis", "psoriasis", "child", "moderate", "Apply Calcipotriene ointment 0.005% once daily for 14 days; consult pediatric dermatologist.", 
+     "Psoriasis in children presents as scaly patches.", 
+     "Moderate", "Chronic condition", "Use gentle treatments, consult dermatologist"),
+    ("psoriasis", "psoriasis", "child", "severe", "Seek pediatric dermatologist immediately; consider phototherapy under supervision.", 
+     "Psoriasis in children presents as scaly patches.", 
+     "Severe", "Severe flare-up", "Immediate medical consultation"),
+
+    ("acne", "acne", "adult", "mild", "Use Benzoyl Peroxide 2.5% gel once daily for 2 weeks.", 
+     "Acne is a common skin condition where hair follicles become clogged with oil and dead skin cells.", 
+     "Mild to Severe", "Hormonal changes, bacteria", "Cleanse face regularly"),
+    ("acne", "acne", "adult", "moderate", "Use Benzoyl Peroxide 5% gel twice daily for 4 weeks; consult dermatologist if no improvement.", 
+     "Acne is a common skin condition where hair follicles become clogged with oil and dead skin cells.", 
+     "Moderate", "Excess oil production", "Avoid oily products, consult dermatologist"),
+    ("acne", "acne", "adult", "severe", "Isotretinoin 0.5mg/kg daily for 4-6 months under medical supervision; seek dermatologist immediately.", 
+     "Acne is a common skin condition where hair follicles become clogged with oil and dead skin cells.", 
+     "Severe", "Cystic acne", "Seek medical attention"),
+    ("acne", "acne", "child", "mild", "Use Salicylic Acid 0.5% wash once daily; consult pediatrician.", 
+     "Acne in children can occur due to early hormonal changes.", 
+     "Mild", "Hormonal changes", "Use gentle cleansers, consult pediatrician"),
+    ("acne", "acne", "child", "moderate", "Use Salicylic Acid 1% wash twice daily for 2 weeks; consult pediatrician if persistent.", 
+     "Acne in children can occur due to early hormonal changes.", 
+     "Moderate", "Bacterial infection", "Keep skin clean, consult pediatrician"),
+    ("acne", "acne", "child", "severe", "Seek pediatric dermatologist immediately; consider low-dose isotretinoin under supervision.", 
+     "Acne in children can occur due to early hormonal changes.", 
+     "Severe", "Severe cystic acne", "Immediate medical consultation"),
+
+    # Adding Fever & Cough entries
+    ("fever", "fever and cough", "adult", "mild", "Acetaminophen 500mg every 6 hours as needed (max 3g daily).", 
+     "Fever is a temporary increase in body temperature above the normal range.", 
+     "Mild to Moderate", "Viral or bacterial infections", "Stay hydrated, rest"),
+
+    ("cough", "fever and cough", "adult", "mild", "Dextromethorphan 10-20mg every 4 hours as needed.", 
+     "Cough is a reflex to clear the airways of irritants or mucus.", 
+     "Mild", "Cold or allergies", "Stay hydrated, avoid irritants"),
+
+    ("fever", "fever and cough", "adult", "moderate", "Ibuprofen 400mg every 6 hours as needed (max 3.2g daily).", 
+     "Fever is a temporary increase in body temperature above the normal range.", 
+     "Moderate to Severe", "Infections or inflammation", "Monitor temperature, seek doctor if persistent"),
+
+    ("cough", "fever and cough", "adult", "moderate", "Dextromethorphan 10-20mg every 4 hours as needed.", 
+     "Cough is a reflex to clear the airways of irritants or mucus.", 
+     "Mild", "Cold or allergies", "Stay hydrated, avoid irritants"),
+
+    ("fever", "fever and cough", "child", "severe", "Seek pediatrician immediately if fever exceeds 102°F or lasts over 24 hours.", 
+     "Fever in children often indicates an immune response to infection.", 
+     "Severe", "Serious infections", "Immediate pediatric consultation"),
+
+    ("cough", "fever and cough", "child", "severe", "Honey (for ages 1+), 1-2 tsp at bedtime.", 
+     "Cough in children can be due to viral infections or irritants.", 
+     "Mild", "Viral infections", "Use a humidifier, avoid smoke"),
+
+    # Adding Headache & Fever entries
+    ("headache", "headache and fever", "adult", "mild", "Ibuprofen 200-400mg every 6 hours as needed (max 3.2g daily).", 
+     "Headache is pain in the head, often due to tension or dehydration.", 
+     "Mild to Moderate", "Stress or dehydration", "Stay hydrated, reduce stress"),
+
+    ("fever", "headache and fever", "adult", "mild", "Acetaminophen 500mg every 6 hours as needed (max 3g daily).", 
+     "Fever is a temporary increase in body temperature above the normal range.", 
+     "Mild to Moderate", "Viral or bacterial infections", "Stay hydrated, rest"),
+
+    ("headache", "headache and fever", "child", "moderate", "Acetaminophen 10-15mg/kg every 6 hours as needed.", 
+     "Headache in children may be due to fatigue or minor infections.", 
+     "Mild", "Fatigue or infections", "Ensure rest, monitor symptoms"),
+
+    ("fever", "headache and fever", "child", "moderate", "Acetaminophen 10-15mg/kg every 6 hours. Consult pediatrician if persistent.", 
+     "Fever in children often indicates an immune response to infection.", 
+     "Moderate", "Bacterial infections", "Consult pediatrician if persistent"),
+
+    # Adding Diarrhea & Cough entries
+    ("diarrhea", "diarrhea and cough", "adult", "mild", "Loperamide 2mg after each loose stool (max 8mg daily).", 
+     "Diarrhea involves frequent loose or watery stools.", 
+     "Mild to Moderate", "Food poisoning or viral infection", "Stay hydrated, eat bland foods"),
+
+    ("cough", "diarrhea and cough", "adult", "mild", "Dextromethorphan 10-20mg every 4 hours as needed.", 
+     "Cough is a reflex to clear the airways of irritants or mucus.", 
+     "Mild", "Cold or allergies", "Stay hydrated, avoid irritants"),
+
+    ("diarrhea", "diarrhea and cough", "child", "moderate", "Oral rehydration solution (e.g., Pedialyte), 50-100mL/kg over 4 hours.", 
+     "Diarrhea in children can lead to dehydration if not managed.", 
+     "Mild", "Viral infections", "Use oral rehydration, avoid sugary drinks"),
+
+    ("cough", "diarrhea and cough", "child", "moderate", "Honey (for ages 1+), 1-2 tsp at bedtime.", 
+     "Cough in children can be due to viral infections or irritants.", 
+     "Mild", "Viral infections", "Use a humidifier, avoid smoke")
+]
+
+# Stage timing histograms: buckets grow geometrically from 10 microseconds, so a percentile is
+# reported as the upper bound of the bucket it falls in (within 25%)
+METRICS_BUCKET_BASE_MS = 0.01
+METRICS_BUCKET_GROWTH = 1.25
+METRICS_FLUSH_INTERVAL = 60.0
+METRICS_RETENTION_DAYS = int(os.environ.get("MEDIBOT_METRICS_RETENTION_DAYS", 30))  # older stage_metrics rows are deleted
+
+def metrics_bucket(ms):
+    if ms <= METRICS_BUCKET_BASE_MS:
+        return 0
+    return math.ceil(math.log(ms / METRICS_BUCKET_BASE_MS) / math.log(METRICS_BUCKET_GROWTH))
+
+def metrics_bucket_bound(bucket):
+    return METRICS_BUCKET_BASE_MS * METRICS_BUCKET_GROWTH ** bucket
+
+def histogram_percentile(buckets, fraction):
+    # buckets maps bucket -> count
+    rank = fraction * sum(buckets.values())
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen >= rank:
+            return metrics_bucket_bound(bucket)
+    return None
+
+class Metrics:
+    # Lightweight per-stage timing. Wrap work in span(stage) or decorate it with timed(stage);
+    # durations go into in-process histograms that attach() flushes to the stage_metrics table
+    # every METRICS_FLUSH_INTERVAL seconds and at exit, keeping METRICS_RETENTION_DAYS of rows.
+    # Use metrics_report() to read them back.
+    def __init__(self):
+        self.histograms = {}  # stage -> {bucket: [count, total_ms]}
+        self.lock = threading.Lock()
+        self.db = None
+        self.timer = None
+        self.interval = METRICS_FLUSH_INTERVAL
+
+    def record(self, stage, ms):
+        bucket = metrics_bucket(ms)
+        with self.lock:
+            buckets = self.histograms.get(stage)
+            if buckets is None:
+                buckets = self.histograms[stage] = {}
+            entry = buckets.get(bucket)
+            if entry is None:
+                buckets[bucket] = [1, ms]
+            else:
+                entry[0] += 1
+                entry[1] += ms
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000)
+
+    def timed(self, stage):
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(stage, (time.perf_counter() - start) * 1000)
+            return wrapper
+        return decorate
+
+    def snapshot(self):
+        # {stage: {"count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"}} for what has not been flushed yet
+        with self.lock:
+            histograms = {stage: {bucket: tuple(entry) for bucket, entry in buckets.items()}
+                          for stage, buckets in self.histograms.items()}
+        return {stage: summarize_histogram(buckets) for stage, buckets in histograms.items()}
+
+    def attach(self, db_path="medical_data.db", interval=METRICS_FLUSH_INTERVAL):
+        if self.db is not None:
+            return
+        self.db = get_database(db_path)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS stage_metrics (
+                recorded_at TEXT,
+                stage TEXT,
+                bucket INTEGER,
+                count INTEGER,
+                total_ms REAL
+            )
+        ''')
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_stage_metrics_time ON stage_metrics (recorded_at)")
+        self.interval = interval
+        self._schedule()
+        atexit.register(self.close)
+
+    def _schedule(self):
+        self.timer = threading.Timer(self.interval, self._flush_on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logging.error(f"Metrics flush error: {e}")
+        if self.db is not None:
+            self._schedule()
+
+    def flush(self):
+        if self.db is None:
+            return 0
+        with self.lock:
+            histograms, self.histograms = self.histograms, {}
+        if not histograms:
+            return 0
+        now = datetime.now()
+        recorded_at = now.strftime("%Y-%m-%d %H:%M:%S")
+        cutoff = (now - timedelta(days=METRICS_RETENTION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+        rows = [(recorded_at, stage, bucket, count, total_ms)
+                for stage, buckets in histograms.items() for bucket, (count, total_ms) in buckets.items()]
+        try:
+            # Not timed itself, or every flush would leave a span for the next one to write
+            with self.db.transaction(stage=None) as conn:
+                conn.executemany("INSERT INTO stage_metrics (recorded_at, stage, bucket, count, total_ms) VALUES (?, ?, ?, ?, ?)", rows)
+                conn.execute("DELETE FROM stage_metrics WHERE recorded_at < ?", (cutoff,))
+        except BaseException:
+            with self.lock:
+                self._merge(histograms)
+            raise
+        return len(rows)
+
+    def _merge(self, histograms):
+        for stage, buckets in histograms.items():
+            current = self.histograms.setdefault(stage, {})
+            for bucket, (count, total_ms) in buckets.items():
+                entry = current.setdefault(bucket, [0, 0.0])
+                entry[0] += count
+                entry[1] += total_ms
+
+    def close(self):
+        if self.db is None:
+            return
+        atexit.unregister(self.close)
+        if self.timer is not None:
+            self.timer.cancel()
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logging.error(f"Metrics flush error: {e}")
+        db, self.db = self.db, None
+        db.release()
+
+def summarize_histogram(buckets):
+    # buckets maps bucket -> (count, total_ms)
+    counts = {bucket: count for bucket, (count, _) in buckets.items()}
+    count = sum(counts.values())
+    total_ms = sum(total for _, total in buckets.values())
+    return {"count": count, "mean_ms": total_ms / count if count else None,
+            "p50_ms": histogram_percentile(counts, 0.50), "p95_ms": histogram_percentile(counts, 0.95),
+            "p99_ms": histogram_percentile(counts, 0.99)}
+
+metrics = Metrics()
+
+class Database:
+    # Shared access to one SQLite file. Writes go through a single lock-guarded connection and
+    # reads use a separate connection per thread; both run in WAL mode with a busy timeout so
+    # several terminals can share medical_data.db without "database is locked" errors. Read
+    # connections of threads that have exited are closed when the next one is opened.
+    # Each connection keeps a cache of prepared statements.
+    def __init__(self, path="medical_data.db", timeout=10.0, cached_statements=256):
+        self.path = path
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.users = 0
+        self.write_lock = threading.RLock()
+        self.local = threading.local()
+        self.read_conns = {}  # thread -> connection
+        self.write_conn = self._connect()
+        self.write_conn.execute("PRAGMA journal_mode=WAL")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        # With WAL, NORMAL sync is crash-safe and avoids an fsync on every commit
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _reader(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = self._connect()
+            with self.write_lock:
+                for thread in [thread for thread in self.read_conns if not thread.is_alive()]:
+                    self.read_conns.pop(thread).close()
+                self.read_conns[threading.current_thread()] = conn
+        return conn
+
+    def query(self, sql, params=()):
+        with metrics.span("db.read"):
+            return self._reader().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        with metrics.span("db.read"):
+            return self._reader().execute(sql, params).fetchone()
+
+    @metrics.timed("db.write")
+    def execute(self, sql, params=()):
+        # Single write statement in its own transaction; returns the cursor for lastrowid/rowcount
+        with self.write_lock:
+            try:
+                cursor = self.write_conn.execute(sql, params)
+                self.write_conn.commit()
+                return cursor
+            except sqlite3.Error:
+                self.write_conn.rollback()
+                raise
+
+    @contextmanager
+    def transaction(self, stage="db.transaction"):
+        # Several writes committed together; BEGIN IMMEDIATE takes the write lock up front.
+        # stage names the metrics span; None leaves the transaction untimed.
+        with self.write_lock, metrics.span(stage) if stage else nullcontext():
+            self.write_conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.write_conn
+                self.write_conn.commit()
+            except BaseException:
+                self.write_conn.rollback()
+                raise
+
+    def release(self):
+        # Drop one user; the connections close when the last user is gone
+        with _databases_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            _databases.pop(self.path, None)
+        self.close()
+
+    def close(self):
+        with self.write_lock:
+            for conn in list(self.read_conns.values()) + [self.write_conn]:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self.read_conns = {}
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+def get_database(path="medical_data.db"):
+    # One shared Database per file for the whole process; pair every call with release()
+    with _databases_lock:
+        db = _databases.get(path)
+        if db is None:
+            db = _databases[path] = Database(path)
+        db.users += 1
+        return db
+
+class WriteBehindBuffer:
+    # Collects small writes (profile and session updates) and commits them together in one
+    # transaction, so answering a question never waits on a disk sync. Writes are keyed, and a
+    # newer write for the same key replaces the pending one. The buffer is flushed explicitly at
+    # key points, by a timer after the first pending write, and at interpreter exit.
+    def __init__(self, db, flush_interval=5.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.timer = None
+        atexit.register(self.flush)
+
+    def put(self, key, sql, params):
+        with self.lock:
+            self.pending.pop(key, None)
+            self.pending[key] = (sql, params)
+            if self.timer is None and self.flush_interval:
+                self.timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logging.error(f"Write-behind flush error: {e}")
+
+    def _take(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            writes, self.pending = self.pending, OrderedDict()
+        return writes
+
+    def _restore(self, writes):
+        # Put the writes back unless something newer replaced them meanwhile
+        with self.lock:
+            for key, write in writes.items():
+                self.pending.setdefault(key, write)
+
+    def flush(self):
+        # Commit every pending write
+        writes = self._take()
+        if not writes:
+            return 0
+        try:
+            with self.db.transaction() as conn:
+                for sql, params in writes.values():
+                    conn.execute(sql, params)
+        except BaseException:
+            self._restore(writes)
+            raise
+        return len(writes)
+
+    @contextmanager
+    def transaction(self):
+        # A database transaction that starts with every pending write. If the caller's statements
+        # or the commit fail, the rollback undoes the writes too, so they go back into the buffer.
+        writes = self._take()
+        try:
+            with self.db.transaction() as conn:
+                for sql, params in writes.values():
+                    conn.execute(sql, params)
+                yield conn
+        except BaseException:
+            self._restore(writes)
+            raise
+
+    def close(self):
+        atexit.unregister(self.flush)
+        self.flush()
+
+def knowledge_base_hash():
+    content = json.dumps([KB_SCHEMA_VERSION, CONDITIONS_SCHEMA, SAMPLE_CONDITIONS], ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def translatable_texts(questions=QUESTIONS, follow_up_templates=FOLLOW_UP_TEMPLATES):
+    # Every fixed string the intake passes to translate_text, exactly as it is displayed
+    texts = list(questions.values())
+    for templates in follow_up_templates.values():
+        texts.extend(questions["follow_up"] + question for question in templates)
+    texts.extend(RESULT_MESSAGES.values())
+    return list(dict.fromkeys(texts))
+
+def new_patient_data(allergies="", history="", lifestyle=""):
+    return {"age_group": "", "symptoms": [], "vitals": {}, "duration": "", "allergies": allergies,
+            "history": history, "lifestyle": lifestyle, "severity": "mild"}
+
+class IntakeSession:
+    # State of one patient intake, independent of any window. Slotted to stay small when a
+    # server holds many sessions, and serializable so an intake in progress survives restarts.
+    __slots__ = ("username", "patient_data", "diagnosis_state", "follow_up_questions")
+
+    def __init__(self, username="", patient_data=None):
+        self.username = username
+        self.patient_data = patient_data if patient_data is not None else new_patient_data()
+        self.diagnosis_state = "age_group"
+        self.follow_up_questions = []
+
+    def to_bytes(self):
+        # Flat tuple of plain values in marshal's binary format
+        data = self.patient_data
+        return marshal.dumps((SESSION_RECORD_VERSION, self.username, self.diagnosis_state, tuple(self.follow_up_questions),
+                              data["age_group"], tuple(data["symptoms"]), data["vitals"], data["duration"],
+                              data["allergies"], data["history"], data["lifestyle"], data["severity"]), 4)
+
+    @classmethod
+    def from_bytes(cls, record):
+        # Returns None for records written by an incompatible version
+        try:
+            values = marshal.loads(record)
+        except (EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(values, tuple) or not values or values[0] != SESSION_RECORD_VERSION:
+            return None
+        try:
+            # A truncated record, or one with fields added without a version bump, is unusable too
+            (_, username, state, follow_ups, age_group, symptoms, vitals, duration,
+             allergies, history, lifestyle, severity) = values
+            session = cls(username, new_patient_data(allergies, history, lifestyle))
+            session.diagnosis_state = state
+            session.follow_up_questions = list(follow_ups)
+            session.patient_data.update(age_group=age_group, symptoms=list(symptoms), vitals=vitals,
+                                        duration=duration, severity=severity)
+        except (ValueError, TypeError):
+            return None
+        return session
+
+    def reset(self):
+        # Start over from the age_group question, keeping the saved profile answers
+        self.patient_data = new_patient_data(self.patient_data["allergies"], self.patient_data["history"],
+                                             self.patient_data["lifestyle"])
+        self.diagnosis_state = "age_group"
+        self.follow_up_questions = []
+
+@dataclass
+class StepResult:
+    state: str
+    prompt: str = None          # next question to ask (untranslated)
+    notice: str = None          # validation message, shown as-is
+    complete: bool = False      # all questions answered, prescription can be generated
+    profile_changed: bool = False
+
+@dataclass
+class IntakeResult:
+    session: IntakeSession
+    complete: bool
+    prescription: str = None
+    error: str = None
+
+@dataclass
+class ConditionEntry:
+    treatment: str
+    description: str
+    severity: str
+    causes: str
+    prevention: str
+
+@dataclass
+class SymptomFinding:
+    symptom: str
+    urgent: str = None          # serious symptom detected, replaces any treatment advice
+    conditions: list = field(default_factory=list)  # ConditionEntry matches; empty means no specific treatment
+
+@dataclass
+class Prescription:
+    # Structured prescription built once by DiagnosisEngine.prepare_prescription() and rendered
+    # as needed through PRESCRIPTION_RENDERERS ("text", "html", "json", "pdf")
+    age_group: str
+    timestamp: str
+    findings: list = field(default_factory=list)         # SymptomFinding, in symptom order
+    warnings: list = field(default_factory=list)         # vitals warnings
+    patient_info: list = field(default_factory=list)     # (label, value) pairs
+    recommendations: list = field(default_factory=list)  # general advice, omitted when urgent
+    disclaimer: str = ""
+
+    @property
+    def urgent(self):
+        return any(finding.urgent for finding in self.findings)
+
+    @property
+    def patient_label(self):
+        return "Child" if self.age_group == "child" else "Adult"
+
+    def to_dict(self):
+        data = asdict(self)
+        data["urgent"] = self.urgent
+        data["patient_info"] = [{"label": label, "value": value} for label, value in self.patient_info]
+        return data
+
+    def render(self, fmt="text"):
+        return PRESCRIPTION_RENDERERS[fmt](self)
+
+class KeywordMatcher:
+    # Aho-Corasick automaton over lowercase keywords. find() reports every keyword occurring
+    # anywhere in the text (substring semantics, like `keyword in text`) in a single pass,
+    # so the cost per message stays flat as the vocabulary grows.
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for keyword in dict.fromkeys(keywords):
+            self._add(keyword.lower())
+        self._build()
+
+    def _add(self, keyword):
+        state = 0
+        for ch in keyword:
+            next_state = self.goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][ch] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = next_state
+        self.output[state] += (keyword,)
+
+    def _build(self):
+        # Breadth-first failure links; each state inherits the matches of its failure state
+        pending = deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, next_state in self.goto[state].items():
+                pending.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def find(self, text):
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        state = 0
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+class DiagnosisEngine:
+    # Intake state machine, condition lookup and prescription building without any Tk widgets,
+    # so the same logic can be driven by DoctorChatbotApp, a service or a batch run
+    def __init__(self, db_path="medical_data.db"):
+        self.questions = dict(QUESTIONS)
+        self.follow_up_templates = dict(FOLLOW_UP_TEMPLATES)
+        self.follow_up_choices = dict(FOLLOW_UP_CHOICES)
+        self.serious_symptoms = list(SERIOUS_SYMPTOMS)
+        self.skin_keywords = dict(SKIN_KEYWORDS)
+        self.db = get_database(db_path)
+        self.writes = WriteBehindBuffer(self.db)
+        self.init_database()
+
+    def init_database(self):
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS user_profiles (
+                username TEXT PRIMARY KEY,
+                age_group TEXT,
+                allergies TEXT,
+                history TEXT,
+                lifestyle TEXT
+            )
+        ''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS prescriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                prescription_text TEXT,
+                timestamp TEXT
+            )
+        ''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS intake_sessions (
+                username TEXT PRIMARY KEY,
+                state TEXT,
+                record BLOB,
+                updated_at TEXT
+            )
+        ''')
+        # Per-user lookups by id and the newest-first history pages stay O(log n)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_prescriptions_user_id ON prescriptions (username, id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_prescriptions_user_time ON prescriptions (username, timestamp)")
+        self.seed_knowledge_base()
+        self.load_conditions()
+        self.build_matcher()
+
+    def seed_knowledge_base(self):
+        # Reseed the conditions table only when the bundled content has changed
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS kb_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                schema_version INTEGER,
+                seed_hash TEXT,
+                seeded_at TEXT
+            )
+        ''')
+        seed_hash = knowledge_base_hash()
+        current = self.db.query_one("SELECT schema_version, seed_hash FROM kb_version WHERE id = 1")
+        exists = self.db.query_one("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conditions'")
+        if current == (KB_SCHEMA_VERSION, seed_hash) and exists:
+            return False
+
+        # Build the new table next to the old one and swap it in within a single transaction
+        with self.db.transaction() as conn:
+            conn.execute("DROP TABLE IF EXISTS conditions_new")
+            conn.execute(CONDITIONS_SCHEMA.format(table="conditions_new"))
+            conn.executemany("INSERT INTO conditions_new (name, symptom, age_group, severity, treatment, description, severity_info, causes, prevention) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", SAMPLE_CONDITIONS)
+            conn.execute("DROP TABLE IF EXISTS conditions")
+            conn.execute("ALTER TABLE conditions_new RENAME TO conditions")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_conditions_lookup ON conditions (symptom, age_group, severity)")
+            conn.execute("INSERT OR REPLACE INTO kb_version (id, schema_version, seed_hash, seeded_at) VALUES (1, ?, ?, ?)",
+                         (KB_SCHEMA_VERSION, seed_hash, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        logging.info(f"Seeded conditions table with {len(SAMPLE_CONDITIONS)} entries (version {KB_SCHEMA_VERSION}, hash {seed_hash[:12]})")
+        return True
+
+    def load_profile(self, session):
+        self.writes.flush()
+        result = self.db.query_one("SELECT age_group, allergies, history, lifestyle FROM user_profiles WHERE username = ?", (session.username,))
+        if result:
+            data = session.patient_data
+            data["age_group"], data["allergies"], data["history"], data["lifestyle"] = result
+        return result is not None
+
+    def save_profile(self, session):
+        # Buffered; reaches the database with the next flush()
+        data = session.patient_data
+        self.writes.put(("user_profiles", session.username), '''
+            INSERT OR REPLACE INTO user_profiles (username, age_group, allergies, history, lifestyle)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (session.username, data["age_group"], data["allergies"], data["history"], data["lifestyle"]))
+
+    def save_session(self, session):
+        # Buffered like save_profile; call after every answer so an unfinished intake can be resumed
+        self.writes.put(("intake_sessions", session.username),
+                        "INSERT OR REPLACE INTO intake_sessions (username, state, record, updated_at) VALUES (?, ?, ?, ?)",
+                        (session.username, session.diagnosis_state, session.to_bytes(), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+    def discard_session(self, username):
+        self.writes.put(("intake_sessions", username), "DELETE FROM intake_sessions WHERE username = ?", (username,))
+
+    def load_session(self, username):
+        # The unfinished intake saved for username, or None
+        self.writes.flush()
+        row = self.db.query_one("SELECT record FROM intake_sessions WHERE username = ?", (username,))
+        session = IntakeSession.from_bytes(row[0]) if row else None
+        if session is None or session.diagnosis_state not in STATE_ORDER:
+            return None
+        return session
+
+    def flush(self):
+        return self.writes.flush()
+
+    def save_prescription(self, username, prescription, timestamp):
+        # Pending profile updates are committed in the same transaction as the prescription,
+        # which also finishes the user's saved intake; if it fails, both stay as they were
+        with self.writes.transaction() as conn:
+            conn.execute("DELETE FROM intake_sessions WHERE username = ?", (username,))
+            cursor = conn.execute("INSERT INTO prescriptions (username, prescription_text, timestamp) VALUES (?, ?, ?)",
+                                  (username, prescription, timestamp))
+        return cursor.lastrowid
+
+    def get_prescription(self, username, prescription_id):
+        return self.db.query_one("SELECT id, prescription_text, timestamp FROM prescriptions WHERE username = ? AND id = ?",
+                                 (username, prescription_id))
+
+    def delete_prescription(self, username, prescription_id):
+        cursor = self.db.execute("DELETE FROM prescriptions WHERE username = ? AND id = ?", (username, prescription_id))
+        return cursor.rowcount > 0
+
+    def history_page(self, username, before=None, limit=HISTORY_PAGE_SIZE):
+        # Keyset pagination, newest first: returns (rows, has_more) where rows are
+        # (id, prescription_text, timestamp) older than the (timestamp, id) cursor in before
+        if before is None:
+            rows = self.db.query('''
+                SELECT id, prescription_text, timestamp FROM prescriptions
+                WHERE username = ?
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            ''', (username, limit + 1))
+        else:
+            rows = self.db.query('''
+                SELECT id, prescription_text, timestamp FROM prescriptions
+                WHERE username = ? AND (timestamp, id) < (?, ?)
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            ''', (username, before[0], before[1], limit + 1))
+        return rows[:limit], len(rows) > limit
+
+    def count_prescriptions(self, username=None, start=None, end=None):
+        where, params = self._prescription_filter(username, start, end)
+        return self.db.query_one(f"SELECT COUNT(*) FROM prescriptions{where}", params)[0]
+
+    def iter_prescriptions(self, username=None, start=None, end=None, batch_size=500):
+        # Yield (id, username, prescription_text, timestamp) rows in id order, optionally for one user
+        # and a timestamp range, reading batch_size rows at a time
+        where, params = self._prescription_filter(username, start, end)
+        where += " AND id > ?" if where else " WHERE id > ?"
+        last_id = 0
+        while True:
+            rows = self.db.query(f"SELECT id, username, prescription_text, timestamp FROM prescriptions{where} ORDER BY id LIMIT ?",
+                                 params + (last_id, batch_size))
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def _prescription_filter(self, username, start, end):
+        # start and end are "YYYY-MM-DD" dates or full timestamps; both ends are inclusive
+        clauses, params = [], ()
+        if username:
+            clauses.append("username = ?")
+            params += (username,)
+        if start:
+            clauses.append("timestamp >= ?")
+            params += (start,)
+        if end:
+            clauses.append("timestamp <= ?")
+            params += (end + " 23:59:59" if len(end) == 10 else end,)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def step(self, session, answer, severity=None):
+        # Feed one answer into the intake and return what the doctor should say next
+        answer = answer.strip()
+        data = session.patient_data
+        state = session.diagnosis_state
+        result = StepResult(state=state)
+
+        # Store user response
+        if state == "age_group":
+            if answer.lower() in ["child", "adult"]:
+                data["age_group"] = answer.lower()
+                result.profile_changed = True
+            else:
+                result.notice = RESULT_MESSAGES["age_group_invalid"]
+                return result
+        elif state == "vitals":
+            data["vitals"] = self.parse_vitals(answer)
+        elif state == "initial":
+            # Check if the response is a command like "next" after an image upload
+            if answer.lower() != "next":
+                data["symptoms"].append(answer)
+                # Enhance symptom detection with keyword matching
+                hits = self.matcher.find(answer)
+                for condition, keywords in self.skin_keywords.items():
+                    if any(keyword in hits for keyword in keywords):
+                        data["symptoms"].append(condition)
+                        logging.debug("Detected %s from user input: %s", condition, answer)
+                        break
+                # Generate follow-up questions
+                session.follow_up_questions.extend(self.generate_follow_up_questions(answer, hits))
+            # Check if there are follow-up questions (from either text input or image upload)
+            if session.follow_up_questions:
+                session.diagnosis_state = result.state = "follow_up"
+                result.prompt = self.questions["follow_up"] + session.follow_up_questions[0]
+                return result
+        elif state == "follow_up":
+            data["symptoms"].append(answer)
+            if session.follow_up_questions:
+                session.follow_up_questions.pop(0)
+            if session.follow_up_questions:
+                result.prompt = self.questions["follow_up"] + session.follow_up_questions[0]
+                return result
+        elif state in data:
+            data[state] = answer
+            if state in PROFILE_FIELDS:
+                result.profile_changed = True
+
+        if severity:
+            data["severity"] = severity
+
+        # Update diagnosis state
+        next_index = STATE_ORDER.index(state) + 1
+        while next_index < len(STATE_ORDER) and STATE_ORDER[next_index] == "follow_up" and not session.follow_up_questions:
+            next_index += 1
+        if next_index < len(STATE_ORDER):
+            session.diagnosis_state = result.state = STATE_ORDER[next_index]
+            result.prompt = self.questions[session.diagnosis_state]
+        else:
+            result.complete = True
+        return result
+
+    def current_prompt(self, session):
+        if session.diagnosis_state == "follow_up" and session.follow_up_questions:
+            return self.questions["follow_up"] + session.follow_up_questions[0]
+        return self.questions[session.diagnosis_state]
+
+    def expected_vocabulary(self, session):
+        # Closed answers for the current question, used by constrained speech recognition;
+        # None means free text is expected
+        state = session.diagnosis_state
+        if state == "age_group":
+            return ["child", "adult"]
+        if state == "initial":
+            skin_words = [word for words in self.skin_keywords.values() for word in words]
+            return list(dict.fromkeys(list(self.follow_up_templates) + skin_words + self.serious_symptoms + ["next"]))
+        if state == "follow_up":
+            question = session.follow_up_questions[0] if session.follow_up_questions else ""
+            return self.follow_up_choices.get(question, ["yes", "no"])
+        return None
+
+    def run_batch(self, sessions):
+        # Run many intakes back to back. Each item is a (session, answers) pair; the answers are
+        # fed through step() in order and a prescription is built for every completed intake.
+        results = []
+        for session, answers in sessions:
+            complete = False
+            for answer in answers:
+                complete = self.step(session, answer).complete
+            intake = IntakeResult(session=session, complete=complete)
+            if complete:
+                try:
+                    intake.prescription = self.build_prescription(session)
+                except Exception as e:
+                    intake.error = str(e)
+            results.append(intake)
+        return results
+
+    def parse_vitals(self, response):
+        vitals = {}
+        try:
+            temp_match = re.search(r'temperature\s*(\d+\.?\d*)\s*(°F|F|°C|C|degrees)', response, re.IGNORECASE)
+            hr_match = re.search(r'heart rate\s*(\d+)\s*(bpm)?', response, re.IGNORECASE)
+            if temp_match:
+                temp = float(temp_match.group(1))
+                unit = temp_match.group(2).upper()
+                if "C" in unit:
+                    temp = (temp * 9/5) + 32  # Convert Celsius to Fahrenheit
+                vitals["temperature"] = temp
+            if hr_match:
+                vitals["heart_rate"] = int(hr_match.group(1))
+        except Exception as e:
+            logging.error(f"Error parsing vitals: {e}")
+        return vitals
+
+    def build_matcher(self):
+        # One automaton for condition names, skin keywords and red-flag phrases;
+        # call again after changing any of them
+        keywords = list(self.follow_up_templates) + list(self.serious_symptoms)
+        keywords += [word for words in self.skin_keywords.values() for word in words]
+        keywords += [symptom for symptom, age_group, severity in self.condition_index]
+        self.matcher = KeywordMatcher(keywords)
+
+    def match_symptoms(self, text):
+        return self.matcher.find(text)
+
+    def generate_follow_up_questions(self, symptom_desc, hits=None):
+        if hits is None:
+            hits = self.matcher.find(symptom_desc)
+        questions = []
+        for condition, templates in self.follow_up_templates.items():
+            if condition in hits:
+                questions.extend(templates)
+        return questions[:2]
+
+    def load_conditions(self):
+        # Keep the whole conditions table in memory, keyed by (symptom, age_group, severity)
+        rows = self.db.query('''
+            SELECT symptom, age_group, severity, treatment, description, severity_info, causes, prevention
+            FROM conditions ORDER BY id
+        ''')
+        index = {}
+        for symptom, age_group, severity, *info in rows:
+            index.setdefault((symptom, age_group, severity), []).append(tuple(info))
+        # Resolve the fallback to mild severity ahead of time
+        for symptom, age_group, severity in list(index):
+            if severity == "mild":
+                for other in SEVERITY_LEVELS.values():
+                    index.setdefault((symptom, age_group, other), index[(symptom, age_group, "mild")])
+        self.condition_index = index
+
+    def lookup_conditions(self, symptom, age_group, severity):
+        results = self.condition_index.get((symptom, age_group, severity))
+        if results is None:
+            # Fallback to mild severity if no match
+            results = self.condition_index.get((symptom, age_group, "mild"), [])
+        return results
+
+    @metrics.timed("prescription.build")
+    def prepare_prescription(self, session, timestamp=None):
+        data = session.patient_data
+        if not data["age_group"]:
+            raise ValueError("Age group not specified")
+
+        # Ensure age_group is correctly set
+        age_group = data["age_group"].lower()
+        prescription = Prescription(age_group=age_group, timestamp=timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                    disclaimer=PRESCRIPTION_DISCLAIMER)
+        serious_condition_flag = False
+
+        # Analyze symptoms
+        for symptom_desc in data["symptoms"]:
+            symptom_lower = symptom_desc.lower()
+
+            # Check for serious symptoms
+            hits = self.matcher.find(symptom_lower)
+            for serious in self.serious_symptoms:
+                if serious in hits:
+                    serious_condition_flag = True
+                    prescription.findings.append(SymptomFinding(symptom_lower, urgent=serious))
+                    break
+
+            if serious_condition_flag:
+                continue
+
+            # Look up treatments and additional info
+            results = self.lookup_conditions(symptom_lower, age_group, data["severity"])
+            prescription.findings.append(SymptomFinding(symptom_lower, conditions=[ConditionEntry(*info) for info in results]))
+
+        # Incorporate vitals
+        if data["vitals"].get("temperature"):
+            temp = data["vitals"]["temperature"]
+            if (age_group == "child" and temp > 102) or (age_group == "adult" and temp > 103):
+                prescription.warnings.append(f"High temperature ({temp}°F). Seek medical attention immediately.")
+        if data["vitals"].get("heart_rate"):
+            hr = data["vitals"]["heart_rate"]
+            if hr > 100 or hr < 60:
+                prescription.warnings.append(f"Abnormal heart rate ({hr} bpm). Consult a doctor.")
+
+        # Incorporate patient data
+        info = prescription.patient_info
+        if data["duration"]:
+            info.append(("Symptom Duration", data["duration"]))
+        info.append(("Allergies", data["allergies"] or "None reported"))
+        info.append(("Medical History", data["history"] or "No similar symptoms reported"))
+        info.append(("Lifestyle Factors", data["lifestyle"] or "None reported"))
+
+        # General advice
+        if not serious_condition_flag:
+            prescription.recommendations = [
+                "Verify all medications with a healthcare professional.",
+                "Monitor symptoms and seek medical attention if they worsen.",
+                "Ensure a pediatrician reviews all treatments for children." if age_group == "child" else "Check for drug interactions if on other medications."
+            ]
+        return prescription
+
+    def build_prescription(self, session, timestamp=None):
+        # Plain-text prescription, as stored in the prescriptions table
+        return self.prepare_prescription(session, timestamp).render("text")
+
+    def close(self):
+        if self.db is not None:
+            try:
+                self.writes.close()
+            finally:
+                self.db.release()
+                self.db = None
+
+class TranslationCache:
+    # Two-tier cache for translations: a bounded in-memory LRU in front of the translations table,
+    # so repeated prompts never go back to the network and the cache survives restarts
+    def __init__(self, db_path="medical_data.db", max_entries=2048, prewarm_workers=8):
+        self.max_entries = max_entries
+        self.prewarm_workers = prewarm_workers
+        self.executor = None  # created by the first prewarm and reused for every language
+        self.memory = OrderedDict()
+        self.translators = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self.lock = threading.Lock()
+        self.db = get_database(db_path)
+        try:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS translations (
+                    text TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    PRIMARY KEY (text, language)
+                )
+            ''')
+        except sqlite3.Error as e:
+            # Keep working with the in-memory tier only
+            logging.error(f"Translation cache initialization error: {e}")
+            self.db.release()
+            self.db = None
+
+    def get(self, text, language):
+        # The lock only guards the in-memory LRU; Database does its own locking
+        key = (text, language)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self.memory[key]
+        db = self.db
+        row = None
+        if db is not None:
+            try:
+                row = db.query_one("SELECT translation FROM translations WHERE text = ? AND language = ?", key)
+            except sqlite3.Error as e:
+                logging.error(f"Translation cache read error: {e}")
+        with self.lock:
+            if row:
+                self.stats["disk_hits"] += 1
+                self._remember(key, row[0])
+                return row[0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, text, language, translation):
+        key = (text, language)
+        with self.lock:
+            self._remember(key, translation)
+        db = self.db
+        if db is not None:
+            try:
+                db.execute("INSERT OR REPLACE INTO translations (text, language, translation) VALUES (?, ?, ?)",
+                           (text, language, translation))
+            except sqlite3.Error as e:
+                logging.error(f"Translation cache write error: {e}")
+
+    def _remember(self, key, translation):
+        self.memory[key] = translation
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def translate(self, text, language):
+        # Translator returns the text unchanged when both languages are English
+        if language == 'en':
+            return text
+        with metrics.span("translate.cache"):
+            cached = self.get(text, language)
+        if cached is not None:
+            return cached
+        try:
+            translator = self.translators.get(language)
+            if translator is None:
+                translator = self.translators[language] = translate.Translator(to_lang=language)
+            with metrics.span("translate.remote"):
+                translation = translator.translate(text)
+        except Exception as e:
+            logging.error(f"Translation error: {e}")
+            return text
+        # MyMemory reports quota problems in the translated text itself; don't keep those
+        if not translation.startswith("MYMEMORY WARNING"):
+            self.put(text, language, translation)
+        return translation
+
+    def prewarm(self, texts, language):
+        # Translate every text concurrently so later lookups are served from the cache;
+        # returns how many of the texts are cached afterwards
+        if language == 'en':
+            return len(texts)
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.prewarm_workers, thread_name_prefix="translate")
+        list(self.executor.map(lambda text: self.translate(text, language), texts))
+        with self.lock:
+            return sum(1 for text in texts if (text, language) in self.memory)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.db is not None:
+            self.db.release()
+            self.db = None
+
+class SpeechOutput:
+    # Speaks doctor messages on a dedicated thread so the chat log never waits for audio.
+    # A new message interrupts the one being spoken (barge-in), messages that arrive together
+    # are spoken as one utterance, and muting switches to text-only output.
+    def __init__(self, max_pending=8, coalesce_delay=0.05, barge_in=True):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.coalesce_delay = coalesce_delay
+        self.barge_in = barge_in
+        self.muted = False
+        self.interrupt = threading.Event()
+        self.engine = None
+        # The speech thread, and with it pyttsx3, starts with the first message
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def say(self, text):
+        if self.muted or not text:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="speech-output", daemon=True)
+                self.thread.start()
+        if self.barge_in:
+            self.interrupt.set()
+        self._enqueue(text)
+
+    def cancel(self):
+        # Drop pending messages and cut off the one being spoken
+        self._drain()
+        self.interrupt.set()
+
+    def set_muted(self, muted):
+        self.muted = muted
+        if muted:
+            self.cancel()
+
+    def stop(self):
+        self.cancel()
+        if self.thread is not None:
+            self._enqueue(None)
+
+    def _enqueue(self, item):
+        # Drop the oldest pending message rather than block the caller when the queue is full
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _drain(self):
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _on_word(self, name, location, length):
+        if self.interrupt.is_set():
+            self.engine.stop()
+
+    def _run(self):
+        # pyttsx3 engines must be driven from the thread that created them
+        try:
+            self.engine = pyttsx3.init()
+            self.engine.connect('started-word', self._on_word)
+        except Exception as e:
+            logging.error(f"TTS error: {e}")
+        while True:
+            parts = [self.queue.get()]
+            # Coalesce a burst of messages into a single utterance
+            try:
+                while parts[-1] is not None:
+                    parts.append(self.queue.get(timeout=self.coalesce_delay))
+            except queue.Empty:
+                pass
+            if parts[-1] is None:
+                break
+            if self.muted or self.engine is None:
+                continue
+            self.interrupt.clear()
+            try:
+                with metrics.span("tts.speak"):
+                    self.engine.say(" ".join(parts))
+                    self.engine.runAndWait()
+            except Exception as e:
+                logging.error(f"TTS error: {e}")
+
+class MicrophoneSpeechBackend:
+    # Base for backends that listen on the default microphone
+    name = None
+
+    def capture(self, recognizer, calibrate):
+        with sr.Microphone() as source:
+            if calibrate:
+                recognizer.adjust_for_ambient_noise(source)
+            return recognizer.listen(source)
+
+    def recognize(self, recognizer, audio, vocabulary=None):
+        raise NotImplementedError
+
+class GoogleSpeechBackend(MicrophoneSpeechBackend):
+    # Online Google Web Speech API
+    name = "google"
+
+    def recognize(self, recognizer, audio, vocabulary=None):
+        return recognizer.recognize_google(audio)
+
+class SphinxSpeechBackend(MicrophoneSpeechBackend):
+    # Offline CMU PocketSphinx; with a vocabulary it only spots the expected closed answers,
+    # which is much faster and more reliable than free dictation
+    name = "sphinx"
+
+    def __init__(self, sensitivity=0.9):
+        # Keyword sensitivity on SpeechRecognition's 0-1 scale, written to PocketSphinx as the
+        # threshold 1e(100 * sensitivity - 110); 0.9 gives the usual 1e-20. Lower values accept
+        # weaker matches and spot keywords in noise.
+        self.sensitivity = sensitivity
+
+    def recognize(self, recognizer, audio, vocabulary=None):
+        if not vocabulary:
+            return recognizer.recognize_sphinx(audio)
+        keyword_entries = [(word, self.sensitivity) for word in vocabulary]
+        text = recognizer.recognize_sphinx(audio, keyword_entries=keyword_entries)
+        words = list(dict.fromkeys(text.split()))
+        if not words:
+            raise sr.UnknownValueError()
+        return " ".join(words)
+
+class WavFileSpeechBackend:
+    # Test stub: reads WAV files in turn instead of the microphone. If a transcript with the same
+    # name (.txt) sits next to a file it is returned as the recognized text; otherwise the audio is
+    # passed to the optional real backend.
+    name = "wav"
+
+    def __init__(self, paths, backend=None):
+        self.paths = deque(paths)
+        self.backend = backend
+        self.current = None
+
+    def capture(self, recognizer, calibrate):
+        if not self.paths:
+            raise sr.WaitTimeoutError("No more WAV files")
+        self.current = self.paths.popleft()
+        with sr.AudioFile(self.current) as source:
+            return recognizer.record(source)
+
+    def recognize(self, recognizer, audio, vocabulary=None):
+        transcript_path = os.path.splitext(self.current)[0] + ".txt"
+        if os.path.exists(transcript_path):
+            with open(transcript_path, encoding="utf-8") as f:
+                return f.read().strip()
+        if self.backend is None:
+            raise sr.UnknownValueError()
+        return self.backend.recognize(recognizer, audio, vocabulary)
+
+SPEECH_BACKENDS = {
+    "google": GoogleSpeechBackend,
+    "sphinx": SphinxSpeechBackend
+}
+
+class SpeechCapture:
+    # Records and recognizes speech on a worker thread through a pluggable backend. The microphone
+    # is calibrated for ambient noise once per session; results are picked up from the UI thread
+    # with poll(). When the main backend's service is unreachable the fallback backend is tried.
+    def __init__(self, backend=None, fallback=None):
+        if backend is None:
+            backend_name = os.environ.get("MEDIBOT_SPEECH_BACKEND", "google")
+            backend = SPEECH_BACKENDS.get(backend_name, GoogleSpeechBackend)()
+            if fallback is None and backend.name == "google":
+                fallback = SphinxSpeechBackend()
+        self.backend = backend
+        self.fallback = fallback
+        self.recognizer = None  # created on the first capture
+        self.calibrated = False
+        self.status = "idle"  # idle, listening or recognizing
+        self.results = queue.Queue()
+
+    def start(self, vocabulary=None):
+        if self.status != "idle":
+            return False
+        self.status = "listening"
+        threading.Thread(target=self._run, args=(vocabulary,), name="speech-capture", daemon=True).start()
+        return True
+
+    def poll(self):
+        # Returns ("text", transcript), ("error", RESULT_MESSAGES key or None) or None while busy
+        try:
+            return self.results.get_nowait()
+        except queue.Empty:
+            return None
+
+    @metrics.timed("speech.recognize")
+    def recognize(self, audio, vocabulary=None):
+        try:
+            return self.backend.recognize(self.recognizer, audio, vocabulary)
+        except sr.RequestError as e:
+            if self.fallback is None:
+                raise
+            logging.error(f"Speech backend {self.backend.name} unavailable, using {self.fallback.name}: {e}")
+            return self.fallback.recognize(self.recognizer, audio, vocabulary)
+
+    def _run(self, vocabulary):
+        try:
+            if self.recognizer is None:
+                self.recognizer = sr.Recognizer()
+        except ImportError as e:
+            logging.error(f"Speech recognition unavailable: {e}")
+            self.results.put(("error", "speech_unavailable"))
+            self.status = "idle"
+            return
+        try:
+            with metrics.span("speech.capture"):
+                audio = self.backend.capture(self.recognizer, calibrate=not self.calibrated)
+            self.calibrated = True
+            self.status = "recognizing"
+            self.results.put(("text", self.recognize(audio, vocabulary)))
+        except sr.UnknownValueError:
+            self.results.put(("error", "speech_unclear"))
+        except sr.RequestError:
+            self.results.put(("error", "speech_unavailable"))
+        except Exception as e:
+            logging.error(f"Speech recognition error: {e}")
+            self.results.put(("error", None))
+        finally:
+            self.status = "idle"
+
+# Skin image analysis works on a downscaled RGB copy of the upload
+IMAGE_ANALYSIS_SIZE = (100, 100)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif")
+
+# Uploads are decoded at reduced size, at least IMAGE_DECODE_SIZE, and only a thumbnail is kept
+# per upload; MEDIBOT_IMAGE_MEMORY_BUDGET caps the thumbnail bytes held by one session
+IMAGE_DECODE_SIZE = (256, 256)
+IMAGE_THUMBNAIL_SIZE = (128, 128)
+IMAGE_MEMORY_BUDGET = int(os.environ.get("MEDIBOT_IMAGE_MEMORY_BUDGET", 1024 * 1024))
+
+def open_image_reduced(source, size=IMAGE_DECODE_SIZE):
+    # Decode a path or file object as an RGB image no smaller than size: JPEGs straight from the
+    # smallest DCT scale that still covers size, other formats by an integer reduce() factor
+    with Image.open(source) as image:
+        if image.format == "JPEG":
+            image.draft("RGB", size)
+        factor = min(image.width // size[0], image.height // size[1])
+        if factor > 1 and image.mode in ("RGB", "RGBA", "L"):
+            image = image.reduce(factor)
+        return image.convert("RGB")
+
+class SessionImages:
+    # Thumbnails of the images uploaded during one session. The oldest are dropped once the
+    # total exceeds budget bytes; the latest upload is always kept.
+    def __init__(self, budget=IMAGE_MEMORY_BUDGET, thumbnail_size=IMAGE_THUMBNAIL_SIZE):
+        self.budget = budget
+        self.thumbnail_size = thumbnail_size
+        self.images = deque()
+        self.nbytes = 0
+
+    def add(self, image, key=None):
+        # key identifies the upload (e.g. its content hash) for membership tests
+        thumbnail = image.copy()
+        thumbnail.thumbnail(self.thumbnail_size)
+        size = thumbnail.width * thumbnail.height * len(thumbnail.getbands())
+        self.images.append((thumbnail, size, key))
+        self.nbytes += size
+        while self.nbytes > self.budget and len(self.images) > 1:
+            _, dropped, _ = self.images.popleft()
+            self.nbytes -= dropped
+        return thumbnail
+
+    def __contains__(self, key):
+        return any(key == entry_key for _, _, entry_key in self.images)
+
+    @property
+    def latest(self):
+        return self.images[-1][0] if self.images else None
+
+    def clear(self):
+        self.images.clear()
+        self.nbytes = 0
+
+# Colour thresholds for skin image analysis. Cached analysis results are tied to these values
+# (see image_analysis_config_hash): changing any of them invalidates the cache at the next start,
+# or straight away through ImageAnalysisCache.reload_config().
+IMAGE_THRESHOLDS = {
+    "red_min_r": 180, "red_max_g": 120, "red_max_b": 120,  # Adjusted threshold for redness
+    "white_min": 200,  # Whitish patches for psoriasis
+    "yellow_min_r": 150, "yellow_min_g": 150, "yellow_max_b": 100,  # Yellowish for acne pustules
+    "low_saturation": 0.2,
+    "dark_max_r": 100,
+    "acne_yellow_ratio": 0.05,
+    "psoriasis_white_ratio": 0.1,
+    "rash_redness_ratio": 0.15
+}
+
+def image_color_ratios(pixels, thresholds=IMAGE_THRESHOLDS):
+    # pixels is an (N, 3) uint8 array; every mask is computed in one vectorized pass
+    t = thresholds
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+    r, g, b = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+    total_pixels = len(pixels)
+    red_count = np.count_nonzero((r > t["red_min_r"]) & (g < t["red_max_g"]) & (b < t["red_max_b"]))
+    white_count = np.count_nonzero((pixels > t["white_min"]).all(axis=1))
+    yellow_count = np.count_nonzero((r > t["yellow_min_r"]) & (g > t["yellow_min_g"]) & (b < t["yellow_max_b"]))
+
+    # HSV saturation computed the same way as colorsys.rgb_to_hsv, so thresholds match exactly
+    scaled = pixels / 255.0
+    maxc = scaled.max(axis=1)
+    minc = scaled.min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        saturation = np.where(maxc == minc, 0.0, (maxc - minc) / maxc)
+
+    return {
+        "redness": int(red_count) / total_pixels,
+        "white": int(white_count) / total_pixels,
+        "yellow": int(yellow_count) / total_pixels,
+        "low_saturation": bool((saturation < t["low_saturation"]).any()),
+        "dark": bool((r < t["dark_max_r"]).any()),
+    }
+
+def classify_color_ratios(ratios, thresholds=IMAGE_THRESHOLDS):
+    # Prioritize conditions based on color analysis
+    if ratios["yellow"] > thresholds["acne_yellow_ratio"]:  # Yellowish pustules (acne)
+        return "acne"
+    elif ratios["white"] > thresholds["psoriasis_white_ratio"]:  # White patches (psoriasis)
+        return "psoriasis"
+    elif ratios["redness"] > thresholds["rash_redness_ratio"]:  # Redness (rash)
+        return "rash"
+    elif ratios["low_saturation"] and ratios["dark"]:  # Dry/dull for eczema
+        return "eczema"
+    return None
+
+def analyze_image_details(image):
+    # (condition, ratios) for an image; raises on unreadable images
+    # Convert image to RGB and resize for analysis
+    img = image.convert('RGB').resize(IMAGE_ANALYSIS_SIZE)
+    ratios = image_color_ratios(np.asarray(img))
+
+    # Log the ratios for debugging
+    logging.debug("Redness ratio: %s, White ratio: %s, Yellow ratio: %s", ratios['redness'], ratios['white'], ratios['yellow'])
+
+    condition = classify_color_ratios(ratios)
+    if condition:
+        logging.debug("Detected %s from image analysis", condition)
+    else:
+        logging.debug("No skin condition detected from image")
+    return condition, ratios
+
+@metrics.timed("image.analyze")
+def analyze_image(image):
+    try:
+        return analyze_image_details(image)[0]
+    except Exception as e:
+        logging.error(f"Error analyzing image: {e}")
+        return None
+
+def analyze_image_file(path):
+    try:
+        return analyze_image(open_image_reduced(path))
+    except Exception as e:
+        logging.error(f"Error loading image {path}: {e}")
+        return None
+
+def _analyze_image_chunk(paths):
+    return [analyze_image_file(path) for path in paths]
+
+def _analyze_image_chunk_details(paths):
+    # Worker side of a cached analyze_images run: (phash, condition, ratios) per path, None on failure
+    results = []
+    for path in paths:
+        try:
+            image = open_image_reduced(path)
+            results.append((perceptual_hash(image), *analyze_image_details(image)))
+        except Exception as e:
+            logging.error(f"Error loading image {path}: {e}")
+            results.append(None)
+    return results
+
+def _map_image_chunks(func, items, workers, chunk_size):
+    # func takes a list of items and returns one result per item; chunks run in worker processes
+    # unless there is only one
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    if len(chunks) <= 1 or workers == 1:
+        return [r for chunk in chunks for r in func(chunk)]
+    with futures_process.ProcessPoolExecutor(max_workers=workers) as executor:
+        return [r for result in executor.map(func, chunks) for r in result]
+
+def analyze_images(paths, workers=None, chunk_size=16, cache=None):
+    # Classify many images (a list of files or a folder such as img/) in parallel chunks.
+    # Returns (path, condition) pairs in input order. With an ImageAnalysisCache, images seen
+    # before are answered from it and only new ones are sent to the workers.
+    if isinstance(paths, str) and os.path.isdir(paths):
+        paths = sorted(os.path.join(paths, name) for name in os.listdir(paths)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+    paths = list(paths)
+    if cache is None:
+        return list(zip(paths, _map_image_chunks(_analyze_image_chunk, paths, workers, chunk_size)))
+    hashes = {}
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                hashes[path] = hashlib.sha256(f.read()).hexdigest()
+        except OSError as e:
+            logging.error(f"Error loading image {path}: {e}")
+    results = cache.get_many(hashes.values())
+    # One path per unseen content hash; copies of the same file are analyzed once
+    pending = {}
+    for path, content_hash in hashes.items():
+        if content_hash not in results:
+            pending.setdefault(content_hash, path)
+    details = _map_image_chunks(_analyze_image_chunk_details, list(pending.values()), workers, chunk_size)
+    for content_hash, detail in zip(pending, details):
+        if detail is not None:
+            results[content_hash] = cache.store_analysis(content_hash, *detail)
+    return [(path, results[hashes[path]][0] if hashes.get(path) in results else None) for path in paths]
+
+def image_analysis_config_hash():
+    # Fingerprint of everything that affects an analysis result
+    content = json.dumps([IMAGE_THRESHOLDS, IMAGE_ANALYSIS_SIZE, IMAGE_DECODE_SIZE], sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def perceptual_hash(image):
+    # 64-bit difference hash: survives re-encoding and resizing, so near-identical photos match
+    pixels = np.asarray(image.convert("L").resize((9, 8)), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):016x}"
+
+class ImageAnalysisCache:
+    # Two-tier cache of image analysis results keyed by the SHA-256 of the file content: a bounded
+    # in-memory LRU in front of the image_analysis table. Entries remember the configuration hash
+    # they were computed under and are dropped by reload_config() after the thresholds change. With
+    # perceptual=True a content miss also matches earlier images with the same perceptual hash.
+    def __init__(self, db_path="medical_data.db", max_entries=512, perceptual=False):
+        self.max_entries = max_entries
+        self.perceptual = perceptual
+        self.memory = OrderedDict()  # content hash -> (condition, ratios, perceptual hash)
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "perceptual_hits": 0, "misses": 0}
+        self.lock = threading.Lock()
+        self.config_hash = None
+        self.db = get_database(db_path)
+        try:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS image_analysis (
+                    content_hash TEXT PRIMARY KEY,
+                    config_hash TEXT NOT NULL,
+                    phash TEXT,
+                    condition TEXT,
+                    ratios TEXT,
+                    created_at TEXT
+                )
+            ''')
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_image_analysis_phash ON image_analysis (phash)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_image_analysis_config ON image_analysis (config_hash)")
+        except sqlite3.Error as e:
+            # Keep working with the in-memory tier only
+            logging.error(f"Image analysis cache initialization error: {e}")
+            self.db.release()
+            self.db = None
+        self.reload_config()
+
+    def reload_config(self):
+        # Call after changing IMAGE_THRESHOLDS or the image sizes; results computed under other
+        # settings are forgotten
+        config_hash = image_analysis_config_hash()
+        with self.lock:
+            if config_hash == self.config_hash:
+                return
+            self.memory.clear()
+            self.config_hash = config_hash
+        if self.db is not None:
+            try:
+                # Only take the write lock when there is something to delete
+                if self._query("SELECT 1 FROM image_analysis WHERE config_hash < ? OR config_hash > ? LIMIT 1",
+                               (config_hash, config_hash)):
+                    self.db.execute("DELETE FROM image_analysis WHERE config_hash != ?", (config_hash,))
+            except sqlite3.Error as e:
+                logging.error(f"Image analysis cache invalidation error: {e}")
+
+    def get(self, content_hash):
+        # (condition, ratios) or None
+        with self.lock:
+            entry = self.memory.get(content_hash)
+            if entry is not None:
+                self.memory.move_to_end(content_hash)
+                self.stats["memory_hits"] += 1
+                return entry[:2]
+            config_hash = self.config_hash
+        row = self._query("SELECT condition, ratios, phash FROM image_analysis WHERE content_hash = ? AND config_hash = ?",
+                          (content_hash, config_hash))
+        if not row:
+            return None
+        entry = (row[0], json.loads(row[1]), row[2])
+        with self.lock:
+            self.stats["disk_hits"] += 1
+            self._remember(content_hash, entry)
+        return entry[:2]
+
+    def get_similar(self, phash):
+        with self.lock:
+            for condition, ratios, entry_phash in self.memory.values():
+                if entry_phash == phash:
+                    self.stats["perceptual_hits"] += 1
+                    return condition, ratios
+            config_hash = self.config_hash
+        row = self._query("SELECT condition, ratios FROM image_analysis WHERE phash = ? AND config_hash = ? LIMIT 1",
+                          (phash, config_hash))
+        if not row:
+            return None
+        with self.lock:
+            self.stats["perceptual_hits"] += 1
+        return row[0], json.loads(row[1])
+
+    def get_many(self, content_hashes):
+        # {content_hash: (condition, ratios)} for the hashes analyzed before
+        found = {}
+        for content_hash in dict.fromkeys(content_hashes):
+            cached = self.get(content_hash)
+            if cached is not None:
+                found[content_hash] = cached
+        return found
+
+    def put(self, content_hash, phash, condition, ratios):
+        with self.lock:
+            self._remember(content_hash, (condition, ratios, phash))
+            config_hash = self.config_hash
+        if self.db is not None:
+            try:
+                self.db.execute('''
+                    INSERT OR REPLACE INTO image_analysis (content_hash, config_hash, phash, condition, ratios, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (content_hash, config_hash, phash, condition, json.dumps(ratios), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            except sqlite3.Error as e:
+                logging.error(f"Image analysis cache write error: {e}")
+
+    def store_analysis(self, content_hash, phash, condition, ratios):
+        # Record a result computed elsewhere (e.g. by an analyze_images worker) for a content miss.
+        # With perceptual matching an earlier result for the same perceptual hash is kept instead,
+        # as analyze() would have returned it. Returns the (condition, ratios) that now apply.
+        return self._resolve(content_hash, phash, lambda: (condition, ratios))
+
+    def _resolve(self, content_hash, phash, compute):
+        cached = self.get_similar(phash) if self.perceptual else None
+        if cached is None:
+            with self.lock:
+                self.stats["misses"] += 1
+            cached = compute()
+        self.put(content_hash, phash, *cached)
+        return cached
+
+    def _query(self, sql, params):
+        if self.db is None:
+            return None
+        try:
+            return self.db.query_one(sql, params)
+        except sqlite3.Error as e:
+            logging.error(f"Image analysis cache read error: {e}")
+            return None
 
-# Set up logging
-logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+    def _remember(self, content_hash, entry):
+        self.memory[content_hash] = entry
+        self.memory.move_to_end(content_hash)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def analyze(self, data):
+        # Analyze image file content, reusing an earlier result when possible. Returns
+        # (content_hash, condition, ratios, image); image is the decoded upload, or None when the
+        # result came from the cache without decoding.
+        content_hash = hashlib.sha256(data).hexdigest()
+        cached = self.get(content_hash)
+        if cached is not None:
+            return (content_hash, *cached, None)
+        image = open_image_reduced(io.BytesIO(data))
+        cached = self._resolve(content_hash, perceptual_hash(image), lambda: self._analyze(image))
+        return (content_hash, *cached, image)
+
+    def _analyze(self, image):
+        with metrics.span("image.analyze"):
+            return analyze_image_details(image)
+
+    def close(self):
+        if self.db is not None:
+            self.db.release()
+            self.db = None
+
+class PrescriptionPDFRenderer:
+    # Lays prescription text out on pages and draws it with reportlab. Lines are wrapped to the
+    # page width using per-character widths that are measured once per font and size. One
+    # renderer can draw into a path, a file object, or an in-memory buffer.
+    def __init__(self, font="Helvetica", font_size=12, pagesize=LETTER_PAGE_SIZE, margin=50, top=750, leading=15):
+        self.font = font
+        self.font_size = font_size
+        self.pagesize = pagesize
+        self.margin = margin
+        self.top = top
+        self.leading = leading
+        self.max_width = pagesize[0] - 2 * margin
+        self.lines_per_page = (top - margin) // leading + 1
+        self.char_widths = {}
+
+    def text_width(self, text):
+        widths = self.char_widths
+        total = 0.0
+        for ch in text:
+            width = widths.get(ch)
+            if width is None:
+                width = widths[ch] = pdfmetrics.stringWidth(ch, self.font, self.font_size)
+            total += width
+        return total
+
+    def wrap(self, text):
+        lines = []
+        for paragraph in text.split("\n"):
+            if self.text_width(paragraph) <= self.max_width:
+                lines.append(paragraph)
+                continue
+            line = ""
+            for word in paragraph.split(" "):
+                candidate = f"{line} {word}" if line else word
+                if self.text_width(candidate) <= self.max_width:
+                    line = candidate
+                    continue
+                if line:
+                    lines.append(line)
+                # A single word wider than the page is split across lines
+                while self.text_width(word) > self.max_width:
+                    cut = len(word) - 1
+                    while cut > 1 and self.text_width(word[:cut]) > self.max_width:
+                        cut -= 1
+                    lines.append(word[:cut])
+                    word = word[cut:]
+                line = word
+            lines.append(line)
+        return lines
+
+    def paginate(self, text):
+        lines = self.wrap(text)
+        return [lines[i:i + self.lines_per_page] for i in range(0, len(lines), self.lines_per_page)] or [[]]
+
+    def draw(self, c, text):
+        # Draw text onto an open canvas, starting and ending on a page boundary
+        for page in self.paginate(text):
+            c.setFont(self.font, self.font_size)
+            y = self.top
+            for line in page:
+                c.drawString(self.margin, y, line)
+                y -= self.leading
+            c.showPage()
+
+    @metrics.timed("pdf.render")
+    def render(self, text, target=None):
+        # target is a path or a binary file object; with no target the PDF bytes are returned
+        buffer = io.BytesIO() if target is None else None
+        c = canvas.Canvas(buffer or target, pagesize=self.pagesize)
+        self.draw(c, text)
+        c.save()
+        return buffer.getvalue() if buffer is not None else None
+
+    @metrics.timed("pdf.render_many")
+    def render_many(self, texts, target=None, progress=None):
+        # One document with every text starting on a new page
+        buffer = io.BytesIO() if target is None else None
+        c = canvas.Canvas(buffer or target, pagesize=self.pagesize)
+        for count, text in enumerate(texts, 1):
+            self.draw(c, text)
+            if progress:
+                progress(count)
+        c.save()
+        return buffer.getvalue() if buffer is not None else None
+
+pdf_renderer = PrescriptionPDFRenderer()
+
+# Prescription renderers; each takes a Prescription and assembles its output in one join
+def render_prescription_text(prescription):
+    lines = [f"Prescription for {prescription.patient_label} Patient:", f"Timestamp: {prescription.timestamp}", "",
+             "**Symptoms and Diagnosis**"]
+    for finding in prescription.findings:
+        if finding.urgent:
+            lines.append(f"URGENT: {finding.urgent.capitalize()} is a serious symptom. Seek emergency medical care immediately.")
+        elif finding.conditions:
+            for entry in finding.conditions:
+                lines += [f"- Symptom: {finding.symptom}", f"Treatment: {entry.treatment}", f"Description: {entry.description}",
+                          f"Severity: {entry.severity}", f"Causes: {entry.causes}", f"Prevention: {entry.prevention}", ""]
+        else:
+            lines.append(f"- No specific treatment found for {finding.symptom}. Consult a doctor.")
+    lines += [f"Warning: {warning}" for warning in prescription.warnings]
+    lines.append("**Patient Information**")
+    lines += [f"{label}: {value}" for label, value in prescription.patient_info]
+    if prescription.recommendations:
+        lines += ["", "**General Recommendations**"]
+        lines += [f"- {recommendation}" for recommendation in prescription.recommendations]
+    lines += ["", f"**Disclaimer**: {prescription.disclaimer}"]
+    return "\n".join(lines)
+
+def render_prescription_html(prescription):
+    esc = html.escape
+    parts = [f"<article class=\"prescription\"><h1>Prescription for {prescription.patient_label} Patient</h1>",
+             f"<p class=\"timestamp\">Timestamp: {esc(prescription.timestamp)}</p>", "<h2>Symptoms and Diagnosis</h2><ul>"]
+    for finding in prescription.findings:
+        if finding.urgent:
+            parts.append(f"<li class=\"urgent\"><strong>URGENT:</strong> {esc(finding.urgent.capitalize())} is a serious symptom. "
+                         "Seek emergency medical care immediately.</li>")
+        elif finding.conditions:
+            for entry in finding.conditions:
+                parts.append(f"<li><strong>{esc(finding.symptom)}</strong><dl>"
+                             f"<dt>Treatment</dt><dd>{esc(entry.treatment)}</dd><dt>Description</dt><dd>{esc(entry.description)}</dd>"
+                             f"<dt>Severity</dt><dd>{esc(entry.severity)}</dd><dt>Causes</dt><dd>{esc(entry.causes)}</dd>"
+                             f"<dt>Prevention</dt><dd>{esc(entry.prevention)}</dd></dl></li>")
+        else:
+            parts.append(f"<li>No specific treatment found for {esc(finding.symptom)}. Consult a doctor.</li>")
+    parts.append("</ul>")
+    parts += [f"<p class=\"warning\"><strong>Warning:</strong> {esc(warning)}</p>" for warning in prescription.warnings]
+    parts.append("<h2>Patient Information</h2><dl>")
+    parts += [f"<dt>{esc(label)}</dt><dd>{esc(value)}</dd>" for label, value in prescription.patient_info]
+    parts.append("</dl>")
+    if prescription.recommendations:
+        parts.append("<h2>General Recommendations</h2><ul>")
+        parts += [f"<li>{esc(recommendation)}</li>" for recommendation in prescription.recommendations]
+        parts.append("</ul>")
+    parts.append(f"<p class=\"disclaimer\"><strong>Disclaimer:</strong> {esc(prescription.disclaimer)}</p></article>")
+    return "".join(parts)
+
+def render_prescription_json(prescription):
+    return json.dumps(prescription.to_dict(), ensure_ascii=False)
+
+def render_prescription_pdf(prescription):
+    return pdf_renderer.render(render_prescription_text(prescription))
+
+PRESCRIPTION_RENDERERS = {
+    "text": render_prescription_text,
+    "html": render_prescription_html,
+    "json": render_prescription_json,
+    "pdf": render_prescription_pdf
+}
+
+EXPORT_FORMATS = ("zip", "pdf", "dir")
+
+def filename_part(text):
+    # Usernames may contain "/", ".." or other characters that are not safe in a file name
+    return re.sub(r"[^\w.-]", "_", str(text)).strip(".") or "_"
+
+def prescription_pdf_filename(username, timestamp, prescription_id):
+    stamp = timestamp.replace(' ', '_').replace(':', '')
+    return f"prescription_{filename_part(username)}_{filename_part(stamp)}_{prescription_id}.pdf"
+
+def _render_prescription_chunk(rows):
+    # Worker side of export_prescriptions: (id, username, text, timestamp) rows to (filename, pdf bytes)
+    results = []
+    for prescription_id, username, text, timestamp in rows:
+        results.append((prescription_pdf_filename(username, timestamp, prescription_id), pdf_renderer.render(text)))
+    return results
+
+def export_prescriptions(rows, output, fmt="zip", workers=None, chunk_size=32, progress=None):
+    # Render prescription rows from DiagnosisEngine.iter_prescriptions(). fmt "zip" writes one archive,
+    # "dir" one file per prescription into the output folder (both rendered in worker processes),
+    # and "pdf" one combined document with each prescription starting on a new page.
+    # progress(done) is called as prescriptions are finished. Returns the number exported.
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    done = 0
+    if fmt == "pdf":
+        # A single canvas cannot be shared between processes, so the combined document is drawn here
+        def report(count):
+            nonlocal done
+            done = count
+            if progress:
+                progress(count)
+        pdf_renderer.render_many((row[2] for row in rows), output, report)
+        return done
+
+    rows = iter(rows)
+    chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+    workers = workers or os.cpu_count() or 1
+    if fmt == "zip":
+        archive = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
+    else:
+        os.makedirs(output, exist_ok=True)
+
+    def store(results):
+        nonlocal done
+        for filename, data in results:
+            if fmt == "zip":
+                archive.writestr(filename, data)
+            else:
+                with open(os.path.join(output, filename), "wb") as f:
+                    f.write(data)
+        done += len(results)
+        if progress:
+            progress(done)
+
+    try:
+        with futures_process.ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of chunks in flight so huge exports do not sit in memory
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_render_prescription_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    store(pending.popleft().result())
+            while pending:
+                store(pending.popleft().result())
+    finally:
+        if fmt == "zip":
+            archive.close()
+    return done
 
 class DoctorChatbotApp:
     def __init__(self, root, username):
@@ -32,16 +2308,20 @@ class DoctorChatbotApp:
 
         # Initialize attributes
         self.language = 'en'
-        self.tts_engine = pyttsx3.init()
-        self.patient_data = {"age_group": "", "symptoms": [], "vitals": {}, "duration": "", "allergies": "", "history": "", "lifestyle": "", "severity": "mild"}
-        self.diagnosis_state = "age_group"
-        self.follow_up_questions = []
-        self.prescription_history = []
-        self.uploaded_image = None
+        self.speech_output = SpeechOutput()
+        self.speech_capture = SpeechCapture()
+        self.session = IntakeSession(username)
+        self.history_page = []  # (id, prescription_text, timestamp) rows currently shown
+        self.history_cursors = []  # keyset cursors of the newer pages, for paging back
+        self.history_has_more = False
+        self.unsaved_ids = itertools.count(-1, -1)
+        self.session_images = SessionImages()
         self.theme = "light"  # Add theme state
 
         # Initialize database
         self.init_database()
+        self.translations = TranslationCache("medical_data.db")
+        self.image_cache = ImageAnalysisCache("medical_data.db")
 
         # UI setup with tabs
         self.notebook = ttk.Notebook(self.root)
@@ -120,6 +2400,10 @@ class DoctorChatbotApp:
                                     bg='#28A745', fg='white', font=('Arial', 10, 'bold'))
         self.mic_button.pack(side=tk.LEFT, padx=5)
 
+        self.mute_button = tk.Button(self.input_frame, text="Mute Voice", command=self.toggle_mute, 
+                                     bg='#28A745', fg='white', font=('Arial', 10, 'bold'))
+        self.mute_button.pack(side=tk.LEFT, padx=5)
+
         self.reset_button = tk.Button(self.input_frame, text="Reset Chat", command=self.reset_chat, 
                                       bg='#FF0000', fg='white', font=('Arial', 10, 'bold'))
         self.reset_button.pack(side=tk.LEFT, padx=5)
@@ -129,52 +2413,7 @@ class DoctorChatbotApp:
         self.additional_buttons_frame.grid(row=6, column=0, columnspan=5, padx=10, pady=5, sticky="ew")
 
         # Language selection with search bar using Combobox
-        self.languages = {
-            'Arabic': 'ar',
-            'Assamese': 'as',
-            'Bengali': 'bn',
-            'Bodo': 'brx',
-            'Chinese (Simplified)': 'zh-cn',
-            'Danish': 'da',
-            'Dutch': 'nl',
-            'English': 'en',
-            'Finnish': 'fi',
-            'French': 'fr',
-            'German': 'de',
-            'Greek': 'el',
-            'Gujarati': 'gu',
-            'Hebrew': 'he',
-            'Hindi': 'hi',
-            'Indonesian': 'id',
-            'Italian': 'it',
-            'Japanese': 'ja',
-            'Kannada': 'kn',
-            'Kashmiri': 'ks',
-            'Konkani': 'kok',
-            'Korean': 'ko',
-            'Maithili': 'mai',
-            'Malayalam': 'ml',
-            'Manipuri/Meitei': 'mni',
-            'Marathi': 'mr',
-            'Nepali': 'ne',
-            'Odia': 'or',
-            'Polish': 'pl',
-            'Portuguese': 'pt',
-            'Punjabi': 'pa',
-            'Russian': 'ru',
-            'Sanskrit': 'sa',
-            'Santali': 'sat',
-            'Sindhi': 'sd',
-            'Spanish': 'es',
-            'Swahili': 'sw',
-            'Swedish': 'sv',
-            'Tamil': 'ta',
-            'Telugu': 'te',
-            'Thai': 'th',
-            'Turkish': 'tr',
-            'Urdu': 'ur',
-            'Vietnamese': 'vi'
-        }
+        self.languages = LANGUAGES
         self.all_languages = sorted(self.languages.keys())  # Store the full sorted list for filtering
         self.language_combobox = ttk.Combobox(self.additional_buttons_frame, values=self.all_languages, state='readonly', font=('Arial', 10, 'bold'))
         self.language_combobox.set('Select Language')
@@ -216,260 +2455,31 @@ class DoctorChatbotApp:
                                        bg='#FF0000', fg='white', font=('Arial', 10, 'bold'))
         self.delete_button.pack(padx=5, pady=5, side=tk.LEFT)
 
-        # Diagnostic questions
-        self.questions = {
-            "age_group": "Is the patient a child (under 18) or an adult? Please respond with 'child' or 'adult'.",
-            "vitals": "Please provide any known vital signs (e.g., temperature in °F, heart rate in bpm). Enter 'unknown' if not available.",
-            "initial": "Please describe the patient's symptoms in detail.",
-            "duration": "How long have the symptoms been present?",
-            "allergies": "Does the patient have any known allergies or pre-existing conditions?",
-            "history": "Has the patient experienced similar symptoms before?",
-            "lifestyle": "Can you provide details about the patient's diet, exercise, or recent travel?",
-            "follow_up": "Please answer the following symptom-specific question: ",
-            "final": "Thank you for the information. I will generate a prescription based on the responses."
-        }
-
-        # Follow-up question templates (including skin conditions)
-        self.follow_up_templates = {
-            "fever": ["Is the fever accompanied by a rash?", "Do you have chills or night sweats?"],
-            "cough": ["Is the cough dry or productive (with phlegm)?", "Is the cough worse at night?"],
-            "headache": ["Is the headache accompanied by nausea or sensitivity to light?", "Does it feel like a throbbing pain?"],
-            "diarrhea": ["Is there blood in the stool?", "Are you experiencing dehydration symptoms like dizziness?"],
-            "rash": ["Is the rash itchy?", "Does it spread or change in appearance?"],
-            "eczema": ["Is the skin dry or cracked?", "Is there oozing or crusting?"],
-            "psoriasis": ["Are there thick, scaly patches?", "Is it painful or itchy?"],
-            "acne": ["Is the acne inflamed or pustular?", "Does it appear on the face, back, or chest?"]
-        }
-
-        self.serious_symptoms = ["chest pain", "difficulty breathing", "severe abdominal pain", "unconsciousness", "severe bleeding", "severe skin infection"]
+        # Paging through older prescriptions
+        self.older_button = tk.Button(self.history_frame, text="Older >", command=self.show_older_history, 
+                                      bg='#007BFF', fg='white', font=('Arial', 10, 'bold'))
+        self.older_button.pack(padx=5, pady=5, side=tk.RIGHT)
+
+        self.newer_button = tk.Button(self.history_frame, text="< Newer", command=self.show_newer_history, 
+                                      bg='#007BFF', fg='white', font=('Arial', 10, 'bold'))
+        self.newer_button.pack(padx=5, pady=5, side=tk.RIGHT)
+
+        self.page_label = tk.Label(self.history_frame, text="Page 1", bg='#f0f0f0', font=('Arial', 10))
+        self.page_label.pack(padx=5, pady=5, side=tk.RIGHT)
+
+        # Question text and templates come from the engine
+        self.questions = self.engine.questions
+        self.follow_up_templates = self.engine.follow_up_templates
 
         # Load user profile
         self.load_user_profile()
-        self.display_message("Doctor", self.translate_text(self.questions[self.diagnosis_state]))
+        self.display_message("Doctor", self.translate_text(self.engine.current_prompt(self.session)))
 
     def init_database(self):
         try:
-            self.conn = sqlite3.connect("medical_data.db")
-            self.cursor = self.conn.cursor()
-
-            # Drop existing conditions table to ensure fresh data
-            self.cursor.execute("DROP TABLE IF EXISTS conditions")
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS conditions (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT,
-                    symptom TEXT,
-                    age_group TEXT,
-                    severity TEXT,
-                    treatment TEXT,
-                    description TEXT,
-                    severity_info TEXT,
-                    causes TEXT,
-                    prevention TEXT
-                )
-            ''')
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_profiles (
-                    username TEXT PRIMARY KEY,
-                    age_group TEXT,
-                    allergies TEXT,
-                    history TEXT,
-                    lifestyle TEXT
-                )
-            ''')
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS prescriptions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT,
-                    prescription_text TEXT,
-                    timestamp TEXT
-                )
-            ''')
-
-            # Insert sample data (force insert every time)
-            sample_data = [
-                ("fever", "fever", "adult", "mild", "Acetaminophen 500mg every 6 hours as needed (max 3g daily).", 
-                 "Fever is a temporary increase in body temperature above the normal range.", 
-                 "Mild to Moderate", "Viral or bacterial infections", "Stay hydrated, rest"),
-                ("fever", "fever", "adult", "moderate", "Ibuprofen 400mg every 6 hours as needed (max 3.2g daily).", 
-                 "Fever is a temporary increase in body temperature above the normal range.", 
-                 "Moderate to Severe", "Infections or inflammation", "Monitor temperature, seek doctor if persistent"),
-                ("fever", "fever", "adult", "severe", "Seek medical attention if fever exceeds 103°F or persists beyond 3 days.", 
-                 "Fever is a temporary increase in body temperature above the normal range.", 
-                 "Severe", "Serious infections", "Immediate medical consultation"),
-                ("fever", "fever", "child", "mild", "Acetaminophen 10-15mg/kg every 6 hours as needed (max 75mg/kg daily).", 
-                 "Fever in children often indicates an immune response to infection.", 
-                 "Mild", "Viral infections", "Ensure hydration, monitor temperature"),
-                ("fever", "fever", "child", "moderate", "Acetaminophen 10-15mg/kg every 6 hours. Consult pediatrician if persistent.", 
-                 "Fever in children often indicates an immune response to infection.", 
-                 "Moderate", "Bacterial infections", "Consult pediatrician if persistent"),
-                ("fever", "fever", "child", "severe", "Seek pediatrician immediately if fever exceeds 102°F or lasts over 24 hours.", 
-                 "Fever in children often indicates an immune response to infection.", 
-                 "Severe", "Serious infections", "Immediate pediatric consultation"),
-                
-                ("cough", "cough", "adult", "mild", "Dextromethorphan 10-20mg every 4 hours as needed.", 
-                 "Cough is a reflex to clear the airways of irritants or mucus.", 
-                 "Mild", "Cold or allergies", "Stay hydrated, avoid irritants"),
-                ("cough", "cough", "child", "mild", "Honey (for ages 1+), 1-2 tsp at bedtime.", 
-                 "Cough in children can be due to viral infections or irritants.", 
-                 "Mild", "Viral infections", "Use a humidifier, avoid smoke"),
-                
-                ("headache", "headache", "adult", "mild", "Ibuprofen 200-400mg every 6 hours as needed (max 3.2g daily).", 
-                 "Headache is pain in the head, often due to tension or dehydration.", 
-                 "Mild to Moderate", "Stress or dehydration", "Stay hydrated, reduce stress"),
-                ("headache", "headache", "child", "mild", "Acetaminophen 10-15mg/kg every 6 hours as needed.", 
-                 "Headache in children may be due to fatigue or minor infections.", 
-                 "Mild", "Fatigue or infections", "Ensure rest, monitor symptoms"),
-                
-                ("diarrhea", "diarrhea", "adult", "mild", "Loperamide 2mg after each loose stool (max 8mg daily).", 
-                 "Diarrhea involves frequent loose or watery stools.", 
-                 "Mild to Moderate", "Food poisoning or viral infection", "Stay hydrated, eat bland foods"),
-                ("diarrhea", "diarrhea", "child", "mild", "Oral rehydration solution (e.g., Pedialyte), 50-100mL/kg over 4 hours.", 
-                 "Diarrhea in children can lead to dehydration if not managed.", 
-                 "Mild", "Viral infections", "Use oral rehydration, avoid sugary drinks"),
-                
-                ("rash", "rash", "adult", "mild", "Hydrocortisone cream 1% applied 2-3 times daily for 7 days.", 
-                 "Rash is an area of irritated or swollen skin, often itchy.", 
-                 "Mild", "Allergic reaction", "Avoid irritants, keep skin clean"),
-                ("rash", "rash", "adult", "moderate", "Clotrimazole cream 1% applied twice daily for 2 weeks; consult doctor if no improvement.", 
-                 "Rash is an area of irritated or swollen skin, often itchy.", 
-                 "Moderate", "Fungal infection", "Keep area dry, consult doctor if persistent"),
-                ("rash", "rash", "adult", "severe", "Prednisone 20mg daily for 5 days under medical supervision; seek dermatologist immediately.", 
-                 "Rash is an area of irritated or swollen skin, often itchy.", 
-                 "Severe", "Severe allergic reaction", "Seek medical attention"),
-                ("rash", "rash", "child", "mild", "Hydrocortisone cream 0.5% applied once daily for 5 days; consult pediatrician.", 
-                 "Rash in children can be due to allergies or infections.", 
-                 "Mild", "Allergic reaction", "Use hypoallergenic products, consult pediatrician"),
-                ("rash", "rash", "child", "moderate", "Hydrocortisone cream 0.5% applied twice daily for 7 days; consult pediatrician if persistent.", 
-                 "Rash in children can be due to allergies or infections.", 
-                 "Moderate", "Eczema flare-up", "Keep skin moisturized, avoid triggers"),
-                ("rash", "rash", "child", "severe", "Seek pediatrician immediately if rash spreads or worsens.", 
-                 "Rash in children can be due to allergies or infections.", 
-                 "Severe", "Infection or severe allergy", "Immediate medical consultation"),
-                
-                ("eczema", "eczema", "adult", "mild", "Moisturize with Cetaphil twice daily; apply Hydrocortisone 1% as needed for 7 days.", 
-                 "Eczema causes dry, itchy, and inflamed skin patches.", 
-                 "Mild", "Dry skin or irritants", "Moisturize regularly, avoid harsh soaps"),
-                ("eczema", "eczema", "adult", "moderate", "Apply Tacrolimus ointment 0.1% twice daily for 2 weeks; consult dermatologist if no relief.", 
-                 "Eczema causes dry, itchy, and inflamed skin patches.", 
-                 "Moderate", "Chronic irritation", "Use fragrance-free products, consult dermatologist"),
-                ("eczema", "eczema", "adult", "severe", "Prednisone 20mg daily for 5 days under medical supervision; seek dermatologist immediately.", 
-                 "Eczema causes dry, itchy, and inflamed skin patches.", 
-                 "Severe", "Infection or severe flare-up", "Seek medical attention"),
-                ("eczema", "eczema", "child", "mild", "Moisturize with fragrance-free lotion twice daily; apply Hydrocortisone 0.5% as needed for 5 days.", 
-                 "Eczema in children often appears as itchy patches.", 
-                 "Mild", "Dry skin or allergens", "Use gentle skincare, avoid triggers"),
-                ("eczema", "eczema", "child", "moderate", "Moisturize with fragrance-free lotion; apply Tacrolimus ointment 0.03% twice daily for 7 days; consult pediatrician.", 
-                 "Eczema in children often appears as itchy patches.", 
-                 "Moderate", "Chronic irritation", "Keep skin hydrated, consult pediatrician"),
-                ("eczema", "eczema", "child", "severe", "Apply wet wrap therapy with Hydrocortisone 0.5% twice daily for 3 days; seek pediatrician if infection occurs.", 
-                 "Eczema in children often appears as itchy patches.", 
-                 "Severe", "Infection or severe flare-up", "Immediate pediatric consultation"),
-                
-                ("psoriasis", "psoriasis", "adult", "mild", "Apply Coal tar ointment 2% nightly for 14 days; use moisturizer daily.", 
-                 "Psoriasis causes thick, scaly patches on the skin.", 
-                 "Mild", "Autoimmune response", "Moisturize, avoid stress"),
-                ("psoriasis", "psoriasis", "adult", "moderate", "Apply Calcipotriene ointment 0.005% twice daily for 4 weeks; consult dermatologist.", 
-                 "Psoriasis causes thick, scaly patches on the skin.", 
-                 "Moderate", "Chronic condition", "Use prescribed treatments, consult dermatologist"),
-                ("psoriasis", "psoriasis", "adult", "severe", "Methotrexate 7.5mg weekly under medical supervision; seek dermatologist immediately.", 
-                 "Psoriasis causes thick, scaly patches on the skin.", 
-                 "Severe", "Severe autoimmune flare-up", "Seek medical attention"),
-                ("psoriasis", "psoriasis", "child", "mild", "Apply Coal tar ointment 1% nightly for 7 days; use fragrance-free moisturizer daily.", 
-                 "Psoriasis in children presents as scaly patches.", 
-                 "Mild", "Genetic predisposition", "Moisturize, avoid irritants"),
-                ("psoriasis", "psoriasis", "child", "moderate", "Apply Calcipotriene ointment 0.005% once daily for 14 days; consult pediatric dermatologist.", 
-                 "Psoriasis in children presents as scaly patches.", 
-                 "Moderate", "Chronic condition", "Use gentle treatments, consult dermatologist"),
-                ("psoriasis", "psoriasis", "child", "severe", "Seek pediatric dermatologist immediately; consider phototherapy under supervision.", 
-                 "Psoriasis in children presents as scaly patches.", 
-                 "Severe", "Severe flare-up", "Immediate medical consultation"),
-                
-                ("acne", "acne", "adult", "mild", "Use Benzoyl Peroxide 2.5% gel once daily for 2 weeks.", 
-                 "Acne is a common skin condition where hair follicles become clogged with oil and dead skin cells.", 
-                 "Mild to Severe", "Hormonal changes, bacteria", "Cleanse face regularly"),
-                ("acne", "acne", "adult", "moderate", "Use Benzoyl Peroxide 5% gel twice daily for 4 weeks; consult dermatologist if no improvement.", 
-                 "Acne is a common skin condition where hair follicles become clogged with oil and dead skin cells.", 
-                 "Moderate", "Excess oil production", "Avoid oily products, consult dermatologist"),
-                ("acne", "acne", "adult", "severe", "Isotretinoin 0.5mg/kg daily for 4-6 months under medical supervision; seek dermatologist immediately.", 
-                 "Acne is a common skin condition where hair follicles become clogged with oil and dead skin cells.", 
-                 "Severe", "Cystic acne", "Seek medical attention"),
-                ("acne", "acne", "child", "mild", "Use Salicylic Acid 0.5% wash once daily; consult pediatrician.", 
-                 "Acne in children can occur due to early hormonal changes.", 
-                 "Mild", "Hormonal changes", "Use gentle cleansers, consult pediatrician"),
-                ("acne", "acne", "child", "moderate", "Use Salicylic Acid 1% wash twice daily for 2 weeks; consult pediatrician if persistent.", 
-                 "Acne in children can occur due to early hormonal changes.", 
-                 "Moderate", "Bacterial infection", "Keep skin clean, consult pediatrician"),
-                ("acne", "acne", "child", "severe", "Seek pediatric dermatologist immediately; consider low-dose isotretinoin under supervision.", 
-                 "Acne in children can occur due to early hormonal changes.", 
-                 "Severe", "Severe cystic acne", "Immediate medical consultation"),
-                
-                # Adding Fever & Cough entries
-                ("fever", "fever and cough", "adult", "mild", "Acetaminophen 500mg every 6 hours as needed (max 3g daily).", 
-                 "Fever is a temporary increase in body temperature above the normal range.", 
-                 "Mild to Moderate", "Viral or bacterial infections", "Stay hydrated, rest"),
-                
-                ("cough", "fever and cough", "adult", "mild", "Dextromethorphan 10-20mg every 4 hours as needed.", 
-                 "Cough is a reflex to clear the airways of irritants or mucus.", 
-                 "Mild", "Cold or allergies", "Stay hydrated, avoid irritants"),
-                
-                ("fever", "fever and cough", "adult", "moderate", "Ibuprofen 400mg every 6 hours as needed (max 3.2g daily).", 
-                 "Fever is a temporary increase in body temperature above the normal range.", 
-                 "Moderate to Severe", "Infections or inflammation", "Monitor temperature, seek doctor if persistent"),
-                
-                ("cough", "fever and cough", "adult", "moderate", "Dextromethorphan 10-20mg every 4 hours as needed.", 
-                 "Cough is a reflex to clear the airways of irritants or mucus.", 
-                 "Mild", "Cold or allergies", "Stay hydrated, avoid irritants"),
-                
-                ("fever", "fever and cough", "child", "severe", "Seek pediatrician immediately if fever exceeds 102°F or lasts over 24 hours.", 
-                 "Fever in children often indicates an immune response to infection.", 
-                 "Severe", "Serious infections", "Immediate pediatric consultation"),
-                
-                ("cough", "fever and cough", "child", "severe", "Honey (for ages 1+), 1-2 tsp at bedtime.", 
-                 "Cough in children can be due to viral infections or irritants.", 
-                 "Mild", "Viral infections", "Use a humidifier, avoid smoke"),
-                
-                # Adding Headache & Fever entries
-                ("headache", "headache and fever", "adult", "mild", "Ibuprofen 200-400mg every 6 hours as needed (max 3.2g daily).", 
-                 "Headache is pain in the head, often due to tension or dehydration.", 
-                 "Mild to Moderate", "Stress or dehydration", "Stay hydrated, reduce stress"),
-                
-                ("fever", "headache and fever", "adult", "mild", "Acetaminophen 500mg every 6 hours as needed (max 3g daily).", 
-                 "Fever is a temporary increase in body temperature above the normal range.", 
-                 "Mild to Moderate", "Viral or bacterial infections", "Stay hydrated, rest"),
-                
-                ("headache", "headache and fever", "child", "moderate", "Acetaminophen 10-15mg/kg every 6 hours as needed.", 
-                 "Headache in children may be due to fatigue or minor infections.", 
-                 "Mild", "Fatigue or infections", "Ensure rest, monitor symptoms"),
-                
-                ("fever", "headache and fever", "child", "moderate", "Acetaminophen 10-15mg/kg every 6 hours. Consult pediatrician if persistent.", 
-                 "Fever in children often indicates an immune response to infection.", 
-                 "Moderate", "Bacterial infections", "Consult pediatrician if persistent"),
-                
-                # Adding Diarrhea & Cough entries
-                ("diarrhea", "diarrhea and cough", "adult", "mild", "Loperamide 2mg after each loose stool (max 8mg daily).", 
-                 "Diarrhea involves frequent loose or watery stools.", 
-                 "Mild to Moderate", "Food poisoning or viral infection", "Stay hydrated, eat bland foods"),
-                
-                ("cough", "diarrhea and cough", "adult", "mild", "Dextromethorphan 10-20mg every 4 hours as needed.", 
-                 "Cough is a reflex to clear the airways of irritants or mucus.", 
-                 "Mild", "Cold or allergies", "Stay hydrated, avoid irritants"),
-                
-                ("diarrhea", "diarrhea and cough", "child", "moderate", "Oral rehydration solution (e.g., Pedialyte), 50-100mL/kg over 4 hours.", 
-                 "Diarrhea in children can lead to dehydration if not managed.", 
-                 "Mild", "Viral infections", "Use oral rehydration, avoid sugary drinks"),
-                
-                ("cough", "diarrhea and cough", "child", "moderate", "Honey (for ages 1+), 1-2 tsp at bedtime.", 
-                 "Cough in children can be due to viral infections or irritants.", 
-                 "Mild", "Viral infections", "Use a humidifier, avoid smoke")
-            ]
-            logging.debug("Inserting sample data into conditions table: %s", sample_data)
-            self.cursor.executemany("INSERT INTO conditions (name, symptom, age_group, severity, treatment, description, severity_info, causes, prevention) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", sample_data)
-            self.conn.commit()
-            # Verify insertion
-            self.cursor.execute("SELECT symptom, age_group, severity, treatment FROM conditions")
-            inserted_data = self.cursor.fetchall()
-            logging.debug("Verified data in conditions table: %s", inserted_data)
+            self.engine = DiagnosisEngine("medical_data.db")
+            self.db = self.engine.db
+            metrics.attach("medical_data.db")
 
             # Fix invalid timestamps in the database (run once, then comment out or remove)
             self.fix_invalid_timestamps()
@@ -479,40 +2489,41 @@ class DoctorChatbotApp:
 
     def fix_invalid_timestamps(self):
         try:
-            self.cursor.execute("SELECT id, timestamp FROM prescriptions WHERE timestamp LIKE '2025-04-d %'")
-            invalid_entries = self.cursor.fetchall()
-            for id_, timestamp in invalid_entries:
-                new_timestamp = timestamp.replace('-d ', '-28 ')
-                self.cursor.execute("UPDATE prescriptions SET timestamp = ? WHERE id = ?", (new_timestamp, id_))
-            self.conn.commit()
+            invalid_entries = self.db.query("SELECT id, timestamp FROM prescriptions WHERE timestamp LIKE '2025-04-d %'")
+            if invalid_entries:
+                with self.db.transaction() as conn:
+                    for id_, timestamp in invalid_entries:
+                        new_timestamp = timestamp.replace('-d ', '-28 ')
+                        conn.execute("UPDATE prescriptions SET timestamp = ? WHERE id = ?", (new_timestamp, id_))
             logging.info("Fixed invalid timestamps in prescriptions table.")
         except sqlite3.Error as e:
             logging.error(f"Error fixing timestamps: {e}")
 
     def load_user_profile(self):
         try:
-            self.cursor.execute("SELECT age_group, allergies, history, lifestyle FROM user_profiles WHERE username = ?", (self.username,))
-            result = self.cursor.fetchone()
-            if result:
-                self.patient_data["age_group"], self.patient_data["allergies"], self.patient_data["history"], self.patient_data["lifestyle"] = result
-            # Load prescription history
-            self.cursor.execute("SELECT prescription_text, timestamp FROM prescriptions WHERE username = ? ORDER BY timestamp DESC", (self.username,))
-            self.prescription_history = self.cursor.fetchall()
-            self.update_history_log()
+            self.engine.load_profile(self.session)
+            # Pick up an intake that was interrupted by a crash or restart
+            session = self.engine.load_session(self.username)
+            if session is not None and session.diagnosis_state != "age_group":
+                self.session = session
+                self.display_message("Doctor", self.translate_text(RESULT_MESSAGES["session_resumed"]))
+            # Load the newest page of prescription history
+            self.show_history_page()
         except sqlite3.Error as e:
             logging.error(f"Error loading user profile: {e}")
 
     def save_user_profile(self):
         try:
-            self.cursor.execute('''
-                INSERT OR REPLACE INTO user_profiles (username, age_group, allergies, history, lifestyle)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (self.username, self.patient_data["age_group"], self.patient_data["allergies"], 
-                  self.patient_data["history"], self.patient_data["lifestyle"]))
-            self.conn.commit()
+            self.engine.save_profile(self.session)
         except sqlite3.Error as e:
             logging.error(f"Error saving user profile: {e}")
 
+    def save_session(self):
+        try:
+            self.engine.save_session(self.session)
+        except sqlite3.Error as e:
+            logging.error(f"Error saving session: {e}")
+
     def filter_languages(self, event):
         # Get the current text in the Combobox
         search_text = self.language_combobox.get().strip().lower()
@@ -544,30 +2555,101 @@ class DoctorChatbotApp:
     def set_language(self, lang):
         self.language = self.languages[lang]
         self.display_message("Doctor", f"Language set to {self.language}")
-        self.display_message("Doctor", self.translate_text(self.questions[self.diagnosis_state]))
+        self.display_message("Doctor", self.translate_text(self.questions[self.session.diagnosis_state]))
+        # Translate the rest of the questionnaire in the background so later questions come from memory
+        texts = translatable_texts(self.questions, self.follow_up_templates)
+        threading.Thread(target=self.translations.prewarm, args=(texts, self.language), daemon=True).start()
 
     def translate_text(self, text):
-        try:
-            translator = Translator(to_lang=self.language)
-            return translator.translate(text)
-        except Exception as e:
-            logging.error(f"Translation error: {e}")
-            return text
+        return self.translations.translate(text, self.language)
 
-    def display_message(self, sender, message):
+    def display_message(self, sender, message, speak=True):
         self.chat_log.config(state='normal')
         self.chat_log.insert(tk.END, f"{sender}: {message}\n")
         self.chat_log.config(state='disabled')
         self.chat_log.yview(tk.END)
-        if sender == "Doctor":
+        if sender == "Doctor" and speak:
             self.text_to_speech(message)
 
-    def update_history_log(self):
+    def show_history_page(self, before=None):
+        # Load and draw one page of the prescription history
+        self.history_page, self.history_has_more = self.engine.history_page(self.username, before)
         self.history_log.config(state='normal')
         self.history_log.delete(1.0, tk.END)
-        for prescription, timestamp in self.prescription_history:
-            self.history_log.insert(tk.END, f"[{timestamp}]\n{prescription}\n\n")
+        for entry in self.history_page:
+            self.insert_history_entry(tk.END, entry)
+        self.history_log.config(state='disabled')
+        self.update_history_nav()
+
+    def show_older_history(self):
+        if not self.history_has_more or not self.history_page:
+            return
+        _, _, timestamp = last = self.history_page[-1]
+        self.history_cursors.append((timestamp, last[0]))
+        try:
+            self.show_history_page(self.history_cursors[-1])
+        except sqlite3.Error as e:
+            logging.error(f"Error loading prescription history: {e}")
+
+    def show_newer_history(self):
+        if not self.history_cursors:
+            return
+        self.history_cursors.pop()
+        try:
+            self.show_history_page(self.history_cursors[-1] if self.history_cursors else None)
+        except sqlite3.Error as e:
+            logging.error(f"Error loading prescription history: {e}")
+
+    def update_history_nav(self):
+        self.page_label.config(text=f"Page {len(self.history_cursors) + 1}")
+        self.newer_button.config(state='normal' if self.history_cursors else 'disabled')
+        self.older_button.config(state='normal' if self.history_has_more else 'disabled')
+
+    def insert_history_entry(self, index, entry):
+        # Each entry carries a tag named after its id so it can be patched in place later
+        prescription_id, prescription, timestamp = entry
+        label = f"#{prescription_id}" if prescription_id > 0 else "not saved"
+        self.history_log.insert(index, f"[{timestamp}] ({label})\n{prescription}\n\n", (f"rx{prescription_id}",))
+
+    def selected_history_entry(self):
+        # The prescription under the start of the selection, found through its rx<id> tag
+        for tag in self.history_log.tag_names(tk.SEL_FIRST):
+            if tag.startswith("rx"):
+                prescription_id = int(tag[2:])
+                for entry in self.history_page:
+                    if entry[0] == prescription_id:
+                        return entry
+                return self.engine.get_prescription(self.username, prescription_id)
+        return None
+
+    def add_history_entry(self, entry):
+        # A new prescription goes on top of the newest page without redrawing it;
+        # on older pages it shows up when paging back
+        if self.history_cursors:
+            return
+        self.history_page.insert(0, entry)
+        self.history_log.config(state='normal')
+        self.insert_history_entry("1.0", entry)
+        if len(self.history_page) > HISTORY_PAGE_SIZE:
+            dropped = self.history_page.pop()
+            self.history_log.delete(f"rx{dropped[0]}.first", f"rx{dropped[0]}.last")
+            self.history_has_more = True
+        self.history_log.config(state='disabled')
+        self.update_history_nav()
+
+    def remove_history_entry(self, entry):
+        # Cut the entry out of the view and pull the next older one up to keep the page full
+        self.history_page.remove(entry)
+        self.history_log.config(state='normal')
+        self.history_log.delete(f"rx{entry[0]}.first", f"rx{entry[0]}.last")
+        if self.history_has_more and self.history_page:
+            last = self.history_page[-1]
+            rows, self.history_has_more = self.engine.history_page(self.username, (last[2], last[0]), limit=1)
+            for row in rows:
+                self.history_page.append(row)
+                self.insert_history_entry(tk.END, row)
         self.history_log.config(state='disabled')
+        self.update_history_nav()
 
     def send_response(self, event=None):
         user_response = self.entry_box.get().strip()
@@ -578,291 +2660,110 @@ class DoctorChatbotApp:
         self.entry_box.delete(0, tk.END)
 
         try:
-            # Store user response
-            if self.diagnosis_state == "age_group":
-                if user_response.lower() in ["child", "adult"]:
-                    self.patient_data["age_group"] = user_response.lower()
-                    self.save_user_profile()
-                else:
-                    self.display_message("Doctor", "Please specify 'child' or 'adult'.")
-                    return
-            elif self.diagnosis_state == "vitals":
-                self.patient_data["vitals"] = self.parse_vitals(user_response)
-            elif self.diagnosis_state == "initial":
-                # Check if the response is a command like "next" after an image upload
-                if user_response.lower() != "next":
-                    self.patient_data["symptoms"].append(user_response)
-                    # Enhance symptom detection with keyword matching
-                    symptom_lower = user_response.lower()
-                    if "scaly" in symptom_lower or "scale" in symptom_lower:
-                        self.patient_data["symptoms"].append("psoriasis")
-                        logging.debug("Detected psoriasis from user input: %s", user_response)
-                    elif "dry" in symptom_lower or "cracked" in symptom_lower:
-                        self.patient_data["symptoms"].append("eczema")
-                        logging.debug("Detected eczema from user input: %s", user_response)
-                    elif "pimple" in symptom_lower or "acne" in symptom_lower:
-                        self.patient_data["symptoms"].append("acne")
-                        logging.debug("Detected acne from user input: %s", user_response)
-                    # Generate follow-up questions
-                    self.follow_up_questions.extend(self.generate_follow_up_questions(user_response))
-                # Check if there are follow-up questions (from either text input or image upload)
-                if self.follow_up_questions:
-                    self.diagnosis_state = "follow_up"
-                    self.display_message("Doctor", self.translate_text(self.questions["follow_up"] + self.follow_up_questions[0]))
-                    return
-            elif self.diagnosis_state == "follow_up":
-                self.patient_data["symptoms"].append(user_response)
-                if self.follow_up_questions:
-                    self.follow_up_questions.pop(0)
-                if self.follow_up_questions:
-                    self.display_message("Doctor", self.translate_text(self.questions["follow_up"] + self.follow_up_questions[0]))
-                    return
-            elif self.diagnosis_state in self.patient_data:
-                self.patient_data[self.diagnosis_state] = user_response
-                if self.diagnosis_state in ["allergies", "history", "lifestyle"]:
-                    self.save_user_profile()
-
             # Update severity from slider
-            severity_map = {1: "mild", 2: "moderate", 3: "severe"}
-            self.patient_data["severity"] = severity_map.get(self.severity_scale.get(), "mild")
-
-            # Update diagnosis state
-            state_order = ["age_group", "vitals", "initial", "follow_up", "duration", "allergies", "history", "lifestyle", "final"]
-            current_index = state_order.index(self.diagnosis_state)
-            next_index = current_index + 1
-            while next_index < len(state_order) and state_order[next_index] == "follow_up" and not self.follow_up_questions:
-                next_index += 1
-            if next_index < len(state_order):
-                self.diagnosis_state = state_order[next_index]
-                self.display_message("Doctor", self.translate_text(self.questions[self.diagnosis_state]))
-            else:
+            severity = SEVERITY_LEVELS.get(self.severity_scale.get(), "mild")
+            result = self.engine.step(self.session, user_response, severity=severity)
+            if result.profile_changed:
+                self.save_user_profile()
+            if not result.complete:
+                self.save_session()
+            if result.notice:
+                self.display_message("Doctor", self.translate_text(result.notice))
+            if result.prompt:
+                self.display_message("Doctor", self.translate_text(result.prompt))
+            if result.complete:
                 self.entry_box.config(state='disabled')
                 self.send_button.config(state='disabled')
                 # Automatically generate prescription when reaching the final state
                 self.generate_prescription()
         except Exception as e:
             logging.error(f"Error in send_response: {e}")
-            self.display_message("Doctor", "An error occurred. Please try again or reset the chat.")
-
-    def parse_vitals(self, response):
-        vitals = {}
-        try:
-            temp_match = re.search(r'temperature\s*(\d+\.?\d*)\s*(°F|F|°C|C|degrees)', response, re.IGNORECASE)
-            hr_match = re.search(r'heart rate\s*(\d+)\s*(bpm)?', response, re.IGNORECASE)
-            if temp_match:
-                temp = float(temp_match.group(1))
-                unit = temp_match.group(2).upper()
-                if "C" in unit:
-                    temp = (temp * 9/5) + 32  # Convert Celsius to Fahrenheit
-                vitals["temperature"] = temp
-            if hr_match:
-                vitals["heart_rate"] = int(hr_match.group(1))
-        except Exception as e:
-            logging.error(f"Error parsing vitals: {e}")
-        return vitals
-
-    def generate_follow_up_questions(self, symptom_desc):
-        questions = []
-        symptom_lower = symptom_desc.lower()
-        for condition, templates in self.follow_up_templates.items():
-            if condition in symptom_lower:
-                questions.extend(templates)
-        return questions[:2]
+            self.display_message("Doctor", self.translate_text(RESULT_MESSAGES["error"]))
 
     def text_to_speech(self, text):
-        try:
-            self.tts_engine.say(text)
-            self.tts_engine.runAndWait()
-        except Exception as e:
-            logging.error(f"TTS error: {e}")
+        # Queued for the speech thread; returns immediately
+        self.speech_output.say(text)
+
+    def toggle_mute(self):
+        muted = not self.speech_output.muted
+        self.speech_output.set_muted(muted)
+        self.mute_button.configure(text="Unmute Voice" if muted else "Mute Voice")
 
     def speech_to_text(self):
-        recognizer = sr.Recognizer()
-        mic = sr.Microphone()
+        # Stop talking before the microphone opens so it doesn't pick up the doctor's voice
+        self.speech_output.cancel()
+        if not self.speech_capture.start(self.engine.expected_vocabulary(self.session)):
+            return
+        self.display_message("Doctor", self.translate_text(RESULT_MESSAGES["listening"]), speak=False)
+        self.mic_button.config(state='disabled')
+        self.listening_ticks = 0
+        self.root.after(100, self.poll_speech)
+
+    def poll_speech(self):
+        result = self.speech_capture.poll()
+        if result is None:
+            # Still capturing; animate the mic button as a listening indicator
+            self.listening_ticks += 1
+            label = "Listening" if self.speech_capture.status == "listening" else "Recognizing"
+            self.mic_button.config(text=label + "." * (self.listening_ticks % 4))
+            self.root.after(100, self.poll_speech)
+            return
 
-        try:
-            with mic as source:
-                self.display_message("Doctor", "Listening...")
-                recognizer.adjust_for_ambient_noise(source)
-                audio = recognizer.listen(source)
-            user_response = recognizer.recognize_google(audio)
+        self.mic_button.config(state='normal', text="Speak")
+        kind, value = result
+        if kind == "text":
             self.entry_box.delete(0, tk.END)
-            self.entry_box.insert(0, user_response)
+            self.entry_box.insert(0, value)
             self.send_response()
-        except sr.UnknownValueError:
-            self.display_message("Doctor", "Sorry, I couldn't understand. Please try again.")
-        except sr.RequestError:
-            self.display_message("Doctor", "Sorry, the speech recognition service is unavailable.")
-        except Exception as e:
-            logging.error(f"Speech recognition error: {e}")
+        elif value:
+            self.display_message("Doctor", self.translate_text(RESULT_MESSAGES[value]))
 
     def upload_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.png *.jpg *.jpeg *.gif")])
         if file_path:
             try:
-                self.uploaded_image = Image.open(file_path)
+                with open(file_path, "rb") as f:
+                    data = f.read()
+                # Repeat uploads are answered from the cache without decoding
+                content_hash, detected_condition, _, image = self.image_cache.analyze(data)
+                if content_hash not in self.session_images:
+                    self.session_images.add(image if image is not None else open_image_reduced(io.BytesIO(data), IMAGE_THUMBNAIL_SIZE),
+                                            content_hash)
                 self.display_message("Doctor", f"Image uploaded successfully from {file_path}")
-                # Analyze the image immediately and append the result to symptoms
-                detected_condition = self.analyze_image(self.uploaded_image)
+                # Append the analysis result to symptoms
                 if detected_condition:
-                    self.patient_data["symptoms"].append(detected_condition)
+                    self.session.patient_data["symptoms"].append(detected_condition)
                     self.display_message("Doctor", f"Image analysis suggests: {detected_condition}")
                     # Generate follow-up questions based on the detected condition
-                    self.follow_up_questions.extend(self.generate_follow_up_questions(detected_condition))
-                    if self.follow_up_questions and self.diagnosis_state != "initial":
-                        self.display_message("Doctor", self.translate_text(self.questions["follow_up"] + self.follow_up_questions[0]))
+                    follow_up_questions = self.session.follow_up_questions
+                    follow_up_questions.extend(self.engine.generate_follow_up_questions(detected_condition))
+                    if follow_up_questions and self.session.diagnosis_state != "initial":
+                        self.display_message("Doctor", self.translate_text(self.questions["follow_up"] + follow_up_questions[0]))
+                    self.save_session()
             except Exception as e:
                 logging.error(f"Error loading image: {e}")
-                self.display_message("Doctor", "Failed to load image. Please try again with a valid image file.")
-
-    def analyze_image(self, image):
-        try:
-            # Convert image to RGB and resize for analysis
-            img = image.convert('RGB').resize((100, 100))
-            pixels = list(img.getdata())
-
-            # Simple color analysis for skin conditions
-            red_count = sum(1 for p in pixels if p[0] > 180 and p[1] < 120 and p[2] < 120)  # Adjusted threshold for redness
-            white_count = sum(1 for p in pixels if all(c > 200 for c in p))  # Whitish patches for psoriasis
-            yellow_count = sum(1 for p in pixels if p[0] > 150 and p[1] > 150 and p[2] < 100)  # Yellowish for acne pustules
-            total_pixels = len(pixels)
-            redness_ratio = red_count / total_pixels
-            white_ratio = white_count / total_pixels
-            yellow_ratio = yellow_count / total_pixels
-
-            # Log the ratios for debugging
-            logging.debug(f"Redness ratio: {redness_ratio}, White ratio: {white_ratio}, Yellow ratio: {yellow_ratio}")
-
-            # Prioritize conditions based on color analysis
-            if yellow_ratio > 0.05:  # Threshold for yellowish pustules (acne)
-                logging.debug("Detected acne from image analysis")
-                return "acne"
-            elif white_ratio > 0.1:  # Threshold for white patches (psoriasis)
-                logging.debug("Detected psoriasis from image analysis")
-                return "psoriasis"
-            elif redness_ratio > 0.15:  # Threshold for redness (rash)
-                logging.debug("Detected rash from image analysis")
-                return "rash"
-            elif any(colorsys.rgb_to_hsv(p[0]/255, p[1]/255, p[2]/255)[1] < 0.2 for p in pixels) and any(p[0] < 100 for p in pixels):  # Dry/dull for eczema
-                logging.debug("Detected eczema from image analysis")
-                return "eczema"
-            logging.debug("No skin condition detected from image")
-            return None
-        except Exception as e:
-            logging.error(f"Error analyzing image: {e}")
-            return None
+                self.display_message("Doctor", self.translate_text(RESULT_MESSAGES["image_failed"]))
 
     def generate_prescription(self):
-        if not self.patient_data["age_group"]:
+        if not self.session.patient_data["age_group"]:
             messagebox.showerror("Error", "Age group not specified. Please reset and specify 'child' or 'adult'.")
             return
 
-        # Ensure age_group is correctly set
-        age_group = self.patient_data["age_group"].lower()
-        prescription = f"Prescription for {'Child' if age_group == 'child' else 'Adult'} Patient:\n"
-        # Add timestamp
-        prescription += f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        prescription += "**Symptoms and Diagnosis**\n"
-        serious_condition_flag = False
-
         try:
-            # Analyze symptoms
-            for symptom_desc in self.patient_data["symptoms"]:
-                symptom_lower = symptom_desc.lower()
-                
-                # Check for serious symptoms
-                for serious in self.serious_symptoms:
-                    if serious in symptom_lower:
-                        serious_condition_flag = True
-                        prescription += f"URGENT: {serious.capitalize()} is a serious symptom. Seek emergency medical care immediately.\n"
-                        break
-                
-                if serious_condition_flag:
-                    continue
-
-                # Query database for treatments and additional info
-                try:
-                    # Use exact symptom and ensure severity matches
-                    self.cursor.execute('''
-                        SELECT treatment, description, severity_info, causes, prevention 
-                        FROM conditions 
-                        WHERE symptom = ? AND age_group = ? AND severity = ?
-                    ''', (symptom_lower, age_group, self.patient_data["severity"]))
-                    results = self.cursor.fetchall()
-                    if not results:
-                        # Fallback to mild severity if no match
-                        self.cursor.execute('''
-                            SELECT treatment, description, severity_info, causes, prevention 
-                            FROM conditions 
-                            WHERE symptom = ? AND age_group = ? AND severity = ?
-                        ''', (symptom_lower, age_group, "mild"))
-                        results = self.cursor.fetchall()
-                    for treatment, description, severity_info, causes, prevention in results:
-                        prescription += f"- Symptom: {symptom_lower}\n"
-                        prescription += f"Treatment: {treatment}\n"
-                        prescription += f"Description: {description}\n"
-                        prescription += f"Severity: {severity_info}\n"
-                        prescription += f"Causes: {causes}\n"
-                        prescription += f"Prevention: {prevention}\n\n"
-                    if not results:
-                        prescription += f"- No specific treatment found for {symptom_lower}. Consult a doctor.\n"
-                except sqlite3.Error as e:
-                    logging.error(f"Database query error in generate_prescription: {e}")
-                    prescription += "- Error retrieving treatment. Please consult a doctor.\n"
-
-            # Incorporate vitals
-            if self.patient_data["vitals"].get("temperature"):
-                temp = self.patient_data["vitals"]["temperature"]
-                if (age_group == "child" and temp > 102) or (age_group == "adult" and temp > 103):
-                    prescription += f"Warning: High temperature ({temp}°F). Seek medical attention immediately.\n"
-            if self.patient_data["vitals"].get("heart_rate"):
-                hr = self.patient_data["vitals"]["heart_rate"]
-                if hr > 100 or hr < 60:
-                    prescription += f"Warning: Abnormal heart rate ({hr} bpm). Consult a doctor.\n"
-
-            # Incorporate patient data
-            prescription += "**Patient Information**\n"
-            if self.patient_data["duration"]:
-                prescription += f"Symptom Duration: {self.patient_data['duration']}\n"
-            if self.patient_data["allergies"]:
-                prescription += f"Allergies: {self.patient_data['allergies']}\n"
-            else:
-                prescription += "Allergies: None reported\n"
-            if self.patient_data["history"]:
-                prescription += f"Medical History: {self.patient_data['history']}\n"
-            else:
-                prescription += "Medical History: No similar symptoms reported\n"
-            if self.patient_data["lifestyle"]:
-                prescription += f"Lifestyle Factors: {self.patient_data['lifestyle']}\n"
-            else:
-                prescription += "Lifestyle Factors: None reported\n"
-
-            # General advice
-            if not serious_condition_flag:
-                prescription += "\n**General Recommendations**\n"
-                prescription += "- Verify all medications with a healthcare professional.\n"
-                prescription += "- Monitor symptoms and seek medical attention if they worsen.\n"
-                prescription += f"- {'Ensure a pediatrician reviews all treatments for children.' if age_group == 'child' else 'Check for drug interactions if on other medications.'}\n"
-
-            prescription += "\n**Disclaimer**: These are suggested prescriptions. Consult a qualified doctor to confirm dosages and appropriateness. This chatbot is not a substitute for professional medical advice."
-
-            # Store the prescription in self.current_prescription
-            self.current_prescription = prescription
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # Built once; the text goes to the window and the database, the model to the exports
+            self.current_prescription_model = self.engine.prepare_prescription(self.session, timestamp)
+            prescription = self.current_prescription = self.current_prescription_model.render("text")
 
             # Save to database with corrected timestamp format
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             try:
-                self.cursor.execute("INSERT INTO prescriptions (username, prescription_text, timestamp) VALUES (?, ?, ?)", 
-                                    (self.username, prescription, timestamp))
-                self.conn.commit()
-                self.prescription_history.insert(0, (prescription, timestamp))
-                self.update_history_log()
+                prescription_id = self.engine.save_prescription(self.username, prescription, timestamp)
+                self.add_history_entry((prescription_id, prescription, timestamp))
             except sqlite3.Error as e:
                 logging.error(f"Database error while saving prescription: {e}")
                 messagebox.showerror("Error", "Failed to save prescription to database. It will not appear in history. Check chatbot_errors.log for details.")
                 # Still add to in-memory history to allow PDF export
-                self.prescription_history.insert(0, (prescription, timestamp))
-                self.update_history_log()
+                self.add_history_entry((next(self.unsaved_ids), prescription, timestamp))
 
             # Display prescription in a separate window
             prescription_window = tk.Toplevel(self.root)
@@ -879,10 +2780,10 @@ class DoctorChatbotApp:
             close_button.pack(pady=5)
 
             # Confirm in chat log
-            self.display_message("Doctor", "Prescription generated and displayed in a new window.")
+            self.display_message("Doctor", self.translate_text(RESULT_MESSAGES["prescription_ready"]))
         except Exception as e:
             logging.error(f"Error generating prescription: {e}")
-            self.display_message("Doctor", "Failed to generate prescription. Please try again.")
+            self.display_message("Doctor", self.translate_text(RESULT_MESSAGES["prescription_failed"]))
 
     def export_to_pdf(self):
         if not hasattr(self, "current_prescription"):
@@ -890,17 +2791,9 @@ class DoctorChatbotApp:
             return
 
         try:
-            filename = f"prescription_{self.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-            c = canvas.Canvas(filename, pagesize=letter)
-            c.setFont("Helvetica", 12)
-            y = 750
-            for line in self.current_prescription.split("\n"):
-                c.drawString(50, y, line)
-                y -= 15
-                if y < 50:
-                    c.showPage()
-                    y = 750
-            c.save()
+            filename = f"prescription_{filename_part(self.username)}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+            with open(filename, "wb") as f:
+                f.write(self.current_prescription_model.render("pdf"))
 
             # Create a popup window to display the prescription
             popup = tk.Toplevel(self.root)
@@ -926,40 +2819,15 @@ class DoctorChatbotApp:
 
     def export_selected_to_pdf(self):
         try:
-            # Get selected text from history log
-            selected_text = self.history_log.get(tk.SEL_FIRST, tk.SEL_LAST)
-            if not selected_text:
+            entry = self.selected_history_entry()
+            if not entry:
                 self.display_message("Doctor", "Please select a prescription in the history log.")
                 return
 
-            # Extract timestamp from selected text
-            timestamp_match = re.search(r'\[(\d{4}-\d{2}-\d{1,2} \d{2}:\d{2}:\d{2})\]', selected_text)
-            if not timestamp_match:
-                self.display_message("Doctor", "Could not identify the prescription. Ensure the timestamp is in a valid format [YYYY-MM-DD HH:MM:SS].")
-                return
-
-            timestamp = timestamp_match.group(1)
-            # Query database for the exact prescription
-            self.cursor.execute("SELECT prescription_text FROM prescriptions WHERE username = ? AND timestamp = ?", 
-                                (self.username, timestamp))
-            result = self.cursor.fetchone()
-            if not result:
-                self.display_message("Doctor", "Prescription not found in database.")
-                return
-
-            prescription_text = result[0]
+            prescription_id, prescription_text, timestamp = entry
             # Generate PDF
-            filename = f"prescription_{self.username}_{timestamp.replace(' ', '_').replace(':', '')}.pdf"
-            c = canvas.Canvas(filename, pagesize=letter)
-            c.setFont("Helvetica", 12)
-            y = 750
-            for line in prescription_text.split("\n"):
-                c.drawString(50, y, line)
-                y -= 15
-                if y < 50:
-                    c.showPage()
-                    y = 750
-            c.save()
+            filename = prescription_pdf_filename(self.username, timestamp, prescription_id)
+            pdf_renderer.render(prescription_text, filename)
             self.display_message("Doctor", f"Selected prescription saved as {filename}")
         except tk.TclError:
             self.display_message("Doctor", "Please select a prescription in the history log.")
@@ -969,27 +2837,22 @@ class DoctorChatbotApp:
 
     def delete_selected_prescription(self):
         try:
-            # Get selected text from history log
-            selected_text = self.history_log.get(tk.SEL_FIRST, tk.SEL_LAST)
-            if not selected_text:
+            entry = self.selected_history_entry()
+            if not entry:
                 self.display_message("Doctor", "Please select a prescription in the history log to delete.")
                 return
 
-            # Extract timestamp from selected text
-            timestamp_match = re.search(r'\[(\d{4}-\d{2}-\d{1,2} \d{2}:\d{2}:\d{2})\]', selected_text)
-            if not timestamp_match:
-                self.display_message("Doctor", "Could not identify the prescription. Ensure the timestamp is in a valid format [YYYY-MM-DD HH:MM:SS].")
+            prescription_id, _, timestamp = entry
+            # Delete from database; unsaved prescriptions only live in the view
+            if prescription_id > 0 and not self.engine.delete_prescription(self.username, prescription_id):
+                self.display_message("Doctor", f"Prescription #{prescription_id} could not be deleted. It may already have been removed.")
                 return
 
-            timestamp = timestamp_match.group(1)
-            # Delete from database
-            self.cursor.execute("DELETE FROM prescriptions WHERE username = ? AND timestamp = ?", (self.username, timestamp))
-            self.conn.commit()
-
-            # Update in-memory history
-            self.prescription_history = [(p, t) for p, t in self.prescription_history if t != timestamp]
-            self.update_history_log()
-            self.display_message("Doctor", f"Prescription from {timestamp} has been deleted.")
+            # Patch the visible page
+            if entry in self.history_page:
+                self.remove_history_entry(entry)
+            self.display_message("Doctor", f"Prescription #{prescription_id} from {timestamp} has been deleted." if prescription_id > 0 
+                                 else f"Prescription from {timestamp} has been deleted.")
         except tk.TclError:
             self.display_message("Doctor", "Please select a prescription in the history log to delete.")
         except sqlite3.Error as e:
@@ -1000,21 +2863,21 @@ class DoctorChatbotApp:
             self.display_message("Doctor", "An error occurred while deleting. Please try again.")
 
     def reset_chat(self):
-        # Clear all patient data, including age_group, to start fresh
-        self.patient_data = {"age_group": "", "symptoms": [], "vitals": {}, "duration": "", 
-                             "allergies": self.patient_data["allergies"], "history": self.patient_data["history"], 
-                             "lifestyle": self.patient_data["lifestyle"], "severity": "mild"}
-        # Always start from the age_group question
-        self.diagnosis_state = "age_group"
-        self.follow_up_questions = []
-        self.uploaded_image = None
+        # Clear all patient data, including age_group, and always start from the age_group question
+        try:
+            self.engine.discard_session(self.username)
+            self.engine.flush()
+        except sqlite3.Error as e:
+            logging.error(f"Error saving user profile: {e}")
+        self.session.reset()
+        self.session_images.clear()
         self.chat_log.config(state='normal')
         self.chat_log.delete(1.0, tk.END)
         self.chat_log.config(state='disabled')
         self.entry_box.config(state='normal')
         self.send_button.config(state='normal')
         self.severity_scale.set(1)
-        self.display_message("Doctor", self.translate_text(self.questions[self.diagnosis_state]))
+        self.display_message("Doctor", self.translate_text(self.questions[self.session.diagnosis_state]))
 
     def toggle_theme(self):
         if self.theme == "light":
@@ -1036,14 +2899,18 @@ class DoctorChatbotApp:
             self.additional_buttons_frame.configure(bg='#2e2e2e')
             self.send_button.configure(bg='#28A745', fg='white')
             self.mic_button.configure(bg='#28A745', fg='white')
+            self.mute_button.configure(bg='#28A745', fg='white')
             self.upload_button.configure(bg='#007BFF', fg='white')
             self.prescription_button.configure(bg='#007BFF', fg='white')
             self.pdf_button.configure(bg='#007BFF', fg='white')
             self.reset_button.configure(bg='#FF0000', fg='white')
             self.theme_button.configure(bg='#000000', fg='white')
             self.history_log.configure(bg='#3c3c3c', fg='#ffffff')
+            self.page_label.configure(bg='#2e2e2e', fg='#ffffff')
             self.history_pdf_button.configure(bg='#007BFF', fg='white')
             self.delete_button.configure(bg='#FF0000', fg='white')
+            self.newer_button.configure(bg='#007BFF', fg='white')
+            self.older_button.configure(bg='#007BFF', fg='white')
             self.language_combobox.configure(foreground='white')
             self.language_combobox.option_add('*TCombobox*Listbox*Background', '#007BFF')
             self.language_combobox.option_add('*TCombobox*Listbox*Foreground', 'white')
@@ -1066,14 +2933,18 @@ class DoctorChatbotApp:
             self.additional_buttons_frame.configure(bg='#f0f0f0')
             self.send_button.configure(bg='#28A745', fg='white')
             self.mic_button.configure(bg='#28A745', fg='white')
+            self.mute_button.configure(bg='#28A745', fg='white')
             self.upload_button.configure(bg='#007BFF', fg='white')
             self.prescription_button.configure(bg='#007BFF', fg='white')
             self.pdf_button.configure(bg='#007BFF', fg='white')
             self.reset_button.configure(bg='#FF0000', fg='white')
             self.theme_button.configure(bg='#000000', fg='white')
             self.history_log.configure(bg='#ffffff', fg='#000000')
+            self.page_label.configure(bg='#f0f0f0', fg='#000000')
             self.history_pdf_button.configure(bg='#007BFF', fg='white')
             self.delete_button.configure(bg='#FF0000', fg='white')
+            self.newer_button.configure(bg='#007BFF', fg='white')
+            self.older_button.configure(bg='#007BFF', fg='white')
             self.language_combobox.configure(foreground='white')
             self.language_combobox.option_add('*TCombobox*Listbox*Background', '#007BFF')
             self.language_combobox.option_add('*TCombobox*Listbox*Foreground', 'white')
@@ -1083,7 +2954,10 @@ class DoctorChatbotApp:
 
     def __del__(self):
         try:
-            self.conn.close()
+            self.speech_output.stop()
+            self.engine.close()
+            self.translations.close()
+            self.image_cache.close()
         except:
             pass
 
@@ -1121,15 +2995,13 @@ class LoginApp:
 
     def init_user_database(self):
         try:
-            self.conn = sqlite3.connect("medical_data.db")
-            self.cursor = self.conn.cursor()
-            self.cursor.execute('''
+            self.db = get_database("medical_data.db")
+            self.db.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     username TEXT PRIMARY KEY,
                     password TEXT NOT NULL
                 )
             ''')
-            self.conn.commit()
         except sqlite3.Error as e:
             logging.error(f"User database initialization error: {e}")
             messagebox.showerror("Error", "Failed to initialize user database. Please try again.")
@@ -1143,12 +3015,12 @@ class LoginApp:
             return
         
         try:
-            self.cursor.execute("SELECT password FROM users WHERE username = ?", (username,))
-            result = self.cursor.fetchone()
+            result = self.db.query_one("SELECT password FROM users WHERE username = ?", (username,))
             if result and result[0] == password:
-                self.conn.close()
+                # Keep our handle until the chatbot exits so both windows share one Database
                 self.root.destroy()
                 main_app(username)
+                self.close()
             else:
                 messagebox.showerror("Error", "Incorrect Username or Password")
         except sqlite3.Error as e:
@@ -1165,14 +3037,12 @@ class LoginApp:
         
         try:
             # Check if username already exists
-            self.cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-            if self.cursor.fetchone():
+            if self.db.query_one("SELECT username FROM users WHERE username = ?", (username,)):
                 messagebox.showerror("Error", "Username already exists. Please choose a different username.")
                 return
             
             # Insert new user into the database
-            self.cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-            self.conn.commit()
+            self.db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
             messagebox.showinfo("Success", "Registration successful! Please log in with your new credentials.")
             self.username_entry.delete(0, tk.END)
             self.password_entry.delete(0, tk.END)
@@ -1180,9 +3050,14 @@ class LoginApp:
             logging.error(f"Registration error: {e}")
             messagebox.showerror("Error", "An error occurred during registration. Please try again.")
 
+    def close(self):
+        db, self.db = getattr(self, "db", None), None
+        if db is not None:
+            db.release()
+
     def __del__(self):
         try:
-            self.conn.close()
+            self.close()
         except:
             pass
 
@@ -1190,8 +3065,700 @@ def main_app(username):
     root = tk.Tk()
     app = DoctorChatbotApp(root, username)
     root.mainloop()
+    app.engine.close()
+    metrics.close()
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+HTTP_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+                405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+# Minimal browser client served at / by IntakeServer
+WEB_CLIENT = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Online Doctor Chatbot</title>
+<style>body{font-family:Arial;max-width:700px;margin:20px auto}#log{border:1px solid #ccc;height:400px;overflow-y:auto;padding:8px;white-space:pre-wrap}</style>
+</head><body>
+<h3>Online Doctor Chatbot</h3>
+<div id="start"><input id="user" placeholder="Username"> <input id="password" type="password" placeholder="Password"> <button onclick="start()">Start</button></div>
+<div id="log"></div>
+<input id="answer" size="60" onkeydown="if(event.key==='Enter')send()"> <button onclick="send()">Send</button>
+<script>
+let socket;
+function show(sender, text) {
+    const log = document.getElementById("log");
+    log.textContent += sender + ": " + text + "\\n";
+    log.scrollTop = log.scrollHeight;
+}
+async function start() {
+    const response = await fetch("/sessions", {method: "POST", body: JSON.stringify({username: document.getElementById("user").value,
+                                                                                   password: document.getElementById("password").value})});
+    const session = await response.json();
+    if (!response.ok) { show("Error", session.error); return; }
+    document.getElementById("start").style.display = "none";
+    socket = new WebSocket(`ws://${location.host}/sessions/${session.session_id}/ws`);
+    socket.onmessage = event => { const data = JSON.parse(event.data); show(data.sender, data.message); };
+    session.messages.forEach(message => show("Doctor", message));
+}
+function send() {
+    const box = document.getElementById("answer");
+    if (!socket || !box.value.trim()) return;
+    show("User", box.value);
+    socket.send(JSON.stringify({answer: box.value}));
+    box.value = "";
+}
+</script></body></html>
+"""
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class IntakeServer:
+    # Serves the intake flow to many patients from one process. Each patient gets a session ID;
+    # answers are posted as JSON or sent over the session's WebSocket, and doctor messages are
+    # pushed to every WebSocket attached to that session. Database work runs on a thread pool so
+    # the event loop never waits on SQLite. Sessions are only issued for accounts in the users table
+    # (the same credentials as the login window), expire after session_ttl seconds without activity
+    # and are capped at max_sessions.
+    #   POST   /sessions               {"username", "password", "resume"?}
+    #                                                           -> {"session_id", "state", "messages", "resumed"}
+    #   GET    /sessions/<id>                                   -> {"session_id", "username", "state", "complete"}
+    #   POST   /sessions/<id>/answer   {"answer", "severity"?}  -> {"state", "messages", "complete", "prescription"?,
+    #                                                               "prescription_data"?}
+    #   POST   /sessions/<id>/reset                             -> {"state", "messages"}
+    #   DELETE /sessions/<id>
+    #   GET    /sessions/<id>/ws       WebSocket; send {"answer"}, receive {"sender", "message"}
+    def __init__(self, engine, host="127.0.0.1", port=8765, workers=4, max_body=65536, session_ttl=1800, max_sessions=200):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="intake-db")
+        self.sessions = {}
+        self.sockets = {}
+        self.locks = {}
+        self.last_seen = {}
+        self.completed = set()
+        self.server = None
+        self.reaper = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.reaper = asyncio.ensure_future(self.reap_sessions())
+        return self.server
+
+    async def reap_sessions(self):
+        while True:
+            await asyncio.sleep(min(60, self.session_ttl))
+            await self.expire_sessions()
+
+    async def expire_sessions(self):
+        cutoff = time.monotonic() - self.session_ttl
+        for session_id in [sid for sid, seen in self.last_seen.items() if seen < cutoff]:
+            await self.end_session(session_id)
+
+    def touch(self, session_id):
+        if session_id in self.last_seen:
+            self.last_seen[session_id] = time.monotonic()
+
+    async def serve_forever(self):
+        await self.start()
+        logging.info(f"Intake server listening on http://{self.host}:{self.port}/")
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.reaper is not None:
+            self.reaper.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writers in self.sockets.values():
+            for writer in writers:
+                writer.close()
+        await self.run_db(self.engine.flush)
+        self.executor.shutdown(wait=True)
+
+    async def run_db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            method, path, headers, body = await self.read_request(reader)
+            if headers.get("upgrade", "").lower() == "websocket":
+                await self.handle_websocket(path, headers, reader, writer)
+                return
+            status, payload = await self.route(method, path, body)
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            logging.error(f"Intake server error: {e}")
+            status, payload = 500, {"error": RESULT_MESSAGES["error"]}
+        if isinstance(payload, str):
+            content, content_type = payload.encode("utf-8"), "text/html; charset=utf-8"
+        else:
+            content, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(content)}\r\nConnection: close\r\n\r\n")
+        try:
+            writer.write(head.encode("latin-1") + content)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "Request headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length < 0:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > self.max_body:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), path.split("?", 1)[0], headers, body
+
+    def parse_json(self, body):
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Body must be JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return data
+
+    async def route(self, method, path, body):
+        parts = [part for part in path.split("/") if part]
+        if not parts:
+            if method != "GET":
+                raise HTTPError(405, "Method not allowed")
+            return 200, WEB_CLIENT
+        if parts[0] != "sessions" or len(parts) > 3:
+            raise HTTPError(404, "Not found")
+        if len(parts) == 1:
+            if method != "POST":
+                raise HTTPError(405, "Method not allowed")
+            data = self.parse_json(body)
+            return 201, await self.create_session(data.get("username", ""), data.get("password", ""), data.get("resume", True))
+        session_id = parts[1]
+        if session_id not in self.sessions:
+            raise HTTPError(404, "Unknown session")
+        self.touch(session_id)
+        action = parts[2] if len(parts) == 3 else None
+        if action is None and method == "GET":
+            return 200, self.describe(session_id)
+        if action is None and method == "DELETE":
+            await self.end_session(session_id)
+            return 200, {"session_id": session_id, "ended": True}
+        if action == "answer" and method == "POST":
+            data = self.parse_json(body)
+            return 200, await self.answer(session_id, str(data.get("answer", "")), data.get("severity"))
+        if action == "reset" and method == "POST":
+            return 200, await self.reset(session_id)
+        if action in (None, "answer", "reset"):
+            raise HTTPError(405, "Method not allowed")
+        raise HTTPError(404, "Not found")
+
+    def check_credentials(self, username, password):
+        # Same check as LoginApp.check_login
+        try:
+            row = self.engine.db.query_one("SELECT password FROM users WHERE username = ?", (username,))
+        except sqlite3.Error as e:
+            logging.error(f"Login error: {e}")
+            return False
+        return row is not None and secrets.compare_digest(str(row[0]).encode("utf-8"), password.encode("utf-8"))
+
+    async def create_session(self, username, password, resume=True):
+        username = str(username).strip()
+        password = str(password).strip()
+        if not username or not password:
+            raise HTTPError(400, "username and password are required")
+        if not await self.run_db(self.check_credentials, username, password):
+            raise HTTPError(401, "Invalid username or password")
+        await self.expire_sessions()
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPError(503, "Too many active sessions; try again later")
+        session = IntakeSession(username)
+        await self.run_db(self.engine.load_profile, session)
+        saved = await self.run_db(self.engine.load_session, username) if resume else None
+        resumed = saved is not None and saved.diagnosis_state != "age_group"
+        if resumed:
+            session = saved
+        session_id = secrets.token_urlsafe(16)
+        self.sessions[session_id] = session
+        self.sockets[session_id] = set()
+        self.locks[session_id] = asyncio.Lock()
+        self.last_seen[session_id] = time.monotonic()
+        messages = [RESULT_MESSAGES["session_resumed"]] if resumed else []
+        messages.append(self.engine.current_prompt(session))
+        return {"session_id": session_id, "state": session.diagnosis_state, "messages": messages, "resumed": resumed}
+
+    def describe(self, session_id):
+        session = self.sessions[session_id]
+        return {"session_id": session_id, "username": session.username, "state": session.diagnosis_state,
+                "complete": session_id in self.completed}
+
+    async def answer(self, session_id, answer, severity=None):
+        if not answer.strip():
+            raise HTTPError(400, "answer is required")
+        session = self.sessions[session_id]
+        async with self.locks[session_id]:
+            if session_id in self.completed:
+                raise HTTPError(400, "Intake already complete; reset the session to start over")
+            if severity not in SEVERITY_LEVELS.values():
+                severity = None
+            result = self.engine.step(session, answer, severity=severity)
+            if result.profile_changed:
+                self.engine.save_profile(session)
+            if not result.complete:
+                self.engine.save_session(session)
+            messages = [message for message in (result.notice, result.prompt) if message]
+            response = {"state": session.diagnosis_state, "messages": messages, "complete": result.complete}
+            if result.complete:
+                try:
+                    prescription_id, prescription, text = await self.run_db(self.save_prescription, session)
+                    # Only a saved prescription completes the intake; after a failure the final
+                    # answer can simply be sent again
+                    self.completed.add(session_id)
+                    response["prescription"] = text
+                    response["prescription_data"] = prescription.to_dict()
+                    response["prescription_id"] = prescription_id
+                    messages.append(text)
+                except Exception as e:
+                    logging.error(f"Error generating prescription: {e}")
+                    response["complete"] = False
+                    messages.append(RESULT_MESSAGES["prescription_failed"])
+        for message in messages:
+            await self.push(session_id, "Doctor", message)
+        return response
+
+    def save_prescription(self, session):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        prescription = self.engine.prepare_prescription(session, timestamp)
+        text = prescription.render("text")
+        return self.engine.save_prescription(session.username, text, timestamp), prescription, text
+
+    async def reset(self, session_id):
+        session = self.sessions[session_id]
+        async with self.locks[session_id]:
+            self.engine.discard_session(session.username)
+            await self.run_db(self.engine.flush)
+            session.reset()
+            self.completed.discard(session_id)
+        message = self.engine.questions[session.diagnosis_state]
+        await self.push(session_id, "Doctor", message)
+        return {"state": session.diagnosis_state, "messages": [message]}
+
+    async def end_session(self, session_id):
+        self.sessions.pop(session_id, None)
+        self.locks.pop(session_id, None)
+        self.last_seen.pop(session_id, None)
+        self.completed.discard(session_id)
+        for writer in self.sockets.pop(session_id, ()):
+            writer.close()
+        await self.run_db(self.engine.flush)
+
+    async def push(self, session_id, sender, message):
+        frame = websocket_frame(json.dumps({"sender": sender, "message": message}).encode("utf-8"))
+        for writer in list(self.sockets.get(session_id, ())):
+            try:
+                writer.write(frame)
+                await writer.drain()
+            except ConnectionError:
+                self.sockets[session_id].discard(writer)
+
+    async def handle_websocket(self, path, headers, reader, writer):
+        parts = [part for part in path.split("/") if part]
+        key = headers.get("sec-websocket-key")
+        if len(parts) != 3 or parts[0] != "sessions" or parts[2] != "ws" or parts[1] not in self.sessions or not key:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            writer.close()
+            return
+        session_id = parts[1]
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("ascii"))
+        await writer.drain()
+        self.sockets[session_id].add(writer)
+        try:
+            while True:
+                opcode, payload = await read_websocket_frame(reader, self.max_body)
+                if opcode == 0x8:
+                    writer.write(websocket_frame(payload[:2], opcode=0x8))
+                    await writer.drain()
+                    break
+                if opcode == 0x9:
+                    writer.write(websocket_frame(payload, opcode=0xA))
+                    await writer.drain()
+                elif opcode == 0x1 and session_id in self.sessions:
+                    self.touch(session_id)
+                    try:
+                        data = self.parse_json(payload)
+                        await self.answer(session_id, str(data.get("answer", "")), data.get("severity"))
+                    except HTTPError as e:
+                        writer.write(websocket_frame(json.dumps({"sender": "Error", "message": str(e)}).encode("utf-8")))
+                        await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, HTTPError):
+            pass
+        finally:
+            self.sockets.get(session_id, set()).discard(writer)
+            writer.close()
+
+def websocket_frame(payload, opcode=0x1):
+    # Server frames are final and unmasked
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+    return header + payload
+
+async def read_websocket_frame(reader, max_size):
+    # Returns (opcode, payload) of the next complete message; fragmented messages are joined
+    opcode, payload = None, b""
+    while True:
+        first, second = await reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = int.from_bytes(await reader.readexactly(2), "big")
+        elif length == 127:
+            length = int.from_bytes(await reader.readexactly(8), "big")
+        if len(payload) + length > max_size:
+            raise HTTPError(413, "WebSocket message too large")
+        mask = await reader.readexactly(4) if second & 0x80 else None
+        data = await reader.readexactly(length)
+        if mask:
+            data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+        frame_opcode = first & 0x0F
+        if frame_opcode >= 0x8:
+            # Control frames may arrive between fragments
+            return frame_opcode, data
+        if frame_opcode:
+            opcode = frame_opcode
+        payload += data
+        if first & 0x80:
+            return opcode, payload
+
+def serve(host="127.0.0.1", port=8765, workers=4, db_path="medical_data.db"):
+    engine = DiagnosisEngine(db_path)
+    metrics.attach(db_path)
+    server = IntakeServer(engine, host, port, workers)
+    print(f"Serving intake on http://{host}:{port}/ (Ctrl+C to stop)")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(wait=True)
+        metrics.close()
+        engine.close()
+
+# Inputs for run_benchmarks
+BENCH_VITALS = ["temperature 101.5 F heart rate 92 bpm", "Temperature 38.4 C, heart rate 110", "unknown",
+                "temperature 99 degrees", "heart rate 72 bpm"]
+BENCH_DESCRIPTIONS = ["I have a fever and a bad cough since yesterday", "red itchy rash with small blisters on the arm",
+                      "chest pain and shortness of breath", "headache", "dry skin and acne on the face",
+                      "no particular complaints, just tired"]
+BENCH_ANSWERS = ["adult", "temperature 101 F heart rate 95 bpm", "fever with cough and a sore throat", "yes", "no",
+                 "3 days", "penicillin", "asthma as a child", "office job, no recent travel", "done"]
+
+def _time_call(func, number, repeat):
+    # Best and median time per call over repeat rounds of number calls each
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    rounds.sort()
+    median = rounds[len(rounds) // 2]
+    return {"calls": number, "rounds": repeat, "best_ms": rounds[0] * 1000, "median_ms": median * 1000,
+            "ops_per_s": 1 / median if median else None}
+
+def run_benchmarks(output=None, baseline=None, repeat=5, history_sizes=(10000, 100000), image_dir=None, tolerance=0.10):
+    # Time the hot paths headless against a throwaway database. Only DiagnosisEngine and the
+    # module-level helpers are exercised, so no Tk window, speech engine or translator is created.
+    # Returns (results, regressions); results are also written as JSON to output.
+    image_dir = image_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "img")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = DiagnosisEngine(os.path.join(tmp, "bench.db"))
+        try:
+            images = []
+            paths = []
+            if os.path.isdir(image_dir):
+                for name in sorted(os.listdir(image_dir)):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        paths.append(os.path.join(image_dir, name))
+                        with Image.open(paths[-1]) as image:
+                            image.load()
+                            images.append(image.copy())
+            if images:
+                results["analyze_image"] = _time_call(lambda: [analyze_image(image) for image in images], 1, repeat)
+                results["analyze_image"]["images"] = len(images)
+                # Decode and analyze from disk, as an upload does
+                results["image_upload"] = _time_call(lambda: [analyze_image(open_image_reduced(path)) for path in paths], 1, repeat)
+                results["image_upload"]["images"] = len(paths)
+                # Repeat uploads of the same files, answered by the analysis cache
+                image_cache = ImageAnalysisCache(os.path.join(tmp, "bench.db"))
+                try:
+                    uploads = []
+                    for path in paths:
+                        with open(path, "rb") as f:
+                            uploads.append(f.read())
+                    for data in uploads:
+                        image_cache.analyze(data)
+                    results["image_upload_cached"] = _time_call(lambda: [image_cache.analyze(data) for data in uploads], 1, repeat)
+                    results["image_upload_cached"]["images"] = len(uploads)
+                finally:
+                    image_cache.close()
+
+            results["parse_vitals"] = _time_call(lambda: [engine.parse_vitals(text) for text in BENCH_VITALS], 200, repeat)
+            results["generate_follow_up_questions"] = _time_call(
+                lambda: [engine.generate_follow_up_questions(text) for text in BENCH_DESCRIPTIONS], 200, repeat)
+            keys = list(engine.condition_index)
+            results["lookup_conditions"] = _time_call(lambda: [engine.lookup_conditions(*key) for key in keys], 200, repeat)
+
+            session = IntakeSession("bench")
+            for answer in BENCH_ANSWERS:
+                engine.step(session, answer)
+            prescription = engine.build_prescription(session, "2025-01-01 09:00:00")
+            results["build_prescription"] = _time_call(lambda: engine.build_prescription(session, "2025-01-01 09:00:00"), 200, repeat)
+            results["intake_run"] = _time_call(
+                lambda: engine.run_batch([(IntakeSession("bench"), BENCH_ANSWERS)]), 200, repeat)
+            results["pdf_render"] = _time_call(lambda: pdf_renderer.render(prescription), 20, repeat)
+
+            inserted = 0
+            for size in sorted(history_sizes):
+                with engine.db.transaction() as conn:
+                    conn.executemany("INSERT INTO prescriptions (username, prescription_text, timestamp) VALUES (?, ?, ?)",
+                                     (("bench", prescription, f"2025-01-01 {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}")
+                                      for i in range(inserted, size)))
+                inserted = size
+
+                def load_history():
+                    # First page plus the next nine, as a user paging back would
+                    rows, has_more = engine.history_page("bench")
+                    for _ in range(9):
+                        if not has_more:
+                            break
+                        rows, has_more = engine.history_page("bench", before=(rows[-1][2], rows[-1][0]))
+
+                results[f"history_page_{size}"] = _time_call(load_history, 20, repeat)
+        finally:
+            engine.close()
+
+    report = {"created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0],
+              "platform": sys.platform, "results": results}
+    regressions = []
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            previous = json.load(f).get("results", {})
+        comparison = {}
+        for name, result in results.items():
+            # Best-of-rounds is the least noisy figure to compare
+            if name in previous and previous[name].get("best_ms"):
+                ratio = result["best_ms"] / previous[name]["best_ms"]
+                comparison[name] = {"baseline_best_ms": previous[name]["best_ms"], "ratio": ratio}
+                if ratio > 1 + tolerance:
+                    regressions.append(name)
+        report["baseline"] = {"path": baseline, "tolerance": tolerance, "comparison": comparison, "regressions": regressions}
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    for name, result in results.items():
+        line = f"{name:32} {result['best_ms']:10.3f} ms best {result['median_ms']:10.3f} ms median"
+        if baseline and name in report["baseline"]["comparison"]:
+            ratio = report["baseline"]["comparison"][name]["ratio"]
+            line += f"  x{ratio:.2f} vs baseline" + ("  REGRESSION" if name in regressions else "")
+        print(line)
+    return results, regressions
+
+def metrics_report(db_path="medical_data.db", since=None):
+    # Print count, mean and p50/p95/p99 per stage from the stage_metrics table
+    db = get_database(db_path)
+    try:
+        if not db.query_one("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stage_metrics'"):
+            print("No metrics recorded yet.")
+            return {}
+        where, params = (" WHERE recorded_at >= ?", (since,)) if since else ("", ())
+        rows = db.query(f"SELECT stage, bucket, SUM(count), SUM(total_ms) FROM stage_metrics{where} GROUP BY stage, bucket", params)
+    finally:
+        db.release()
+    if not rows:
+        print("No metrics recorded yet.")
+        return {}
+    histograms = {}
+    for stage, bucket, count, total_ms in rows:
+        histograms.setdefault(stage, {})[bucket] = (count, total_ms)
+    report = {stage: summarize_histogram(buckets) for stage, buckets in sorted(histograms.items())}
+    print(f"{'stage':24} {'count':>8} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for stage, summary in report.items():
+        print(f"{stage:24} {summary['count']:8d} {summary['mean_ms']:10.3f} {summary['p50_ms']:10.3f} "
+              f"{summary['p95_ms']:10.3f} {summary['p99_ms']:10.3f}")
+    return report
+
+def build_language_packs(languages=None, workers=8, db_path="medical_data.db"):
+    # Pre-translate the whole questionnaire into the translations table so offline sites ship it ready
+    codes = {**LANGUAGES, **{code: code for code in LANGUAGES.values()}}
+    selected = []
+    for language in languages or LANGUAGES:
+        if language in codes:
+            selected.append((language, codes[language]))
+        else:
+            print(f"Unknown language: {language}")
+    texts = translatable_texts()
+    cache = TranslationCache(db_path, prewarm_workers=workers)
+    try:
+        for name, code in selected:
+            cached = cache.prewarm(texts, code)
+            print(f"{name} ({code}): {cached}/{len(texts)} strings cached")
+    finally:
+        cache.close()
+    return cache.stats
+
+def export_history(output, username=None, start=None, end=None, fmt="zip", workers=None, db_path="medical_data.db"):
+    engine = DiagnosisEngine(db_path)
+    try:
+        total = engine.count_prescriptions(username, start, end)
+        if not total:
+            print("No prescriptions match.")
+            return 0
+        rows = engine.iter_prescriptions(username, start, end)
+        progress = lambda done: print(f"\rExported {done}/{total}", end="", flush=True)
+        exported = export_prescriptions(rows, output, fmt, workers, progress=progress)
+        print(f"\nWrote {exported} prescriptions to {output}")
+        return exported
+    finally:
+        engine.close()
+
+def startup_report(db_path="medical_data.db"):
+    # Break down the time to the login window by component, then show what each deferred
+    # component costs on first use
+    timings = OrderedDict(STARTUP_TIMINGS)
+
+    def measure(name, func):
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    try:
+        root = measure("create Tk root", tk.Tk)
+        login = measure("build login window", lambda: LoginApp(root))
+        measure("draw login window", root.update)
+        login.close()
+        root.destroy()
+    except tk.TclError as e:
+        print(f"Login window not measured: {e}")
+    to_login = sum(timings.values())
+
+    engine = measure("init DiagnosisEngine", lambda: DiagnosisEngine(db_path))
+    cache = measure("init TranslationCache", lambda: TranslationCache(db_path))
+    measure("init SpeechOutput", SpeechOutput)
+    measure("init SpeechCapture", SpeechCapture)
+    engine.close()
+    cache.close()
+    to_chat = sum(timings.values())
+
+    deferred = OrderedDict()
+    for module in (Image, np, sr, pyttsx3, translate, canvas, pdfmetrics):
+        if module._module is None:
+            start = time.perf_counter()
+            try:
+                module.load()
+                deferred[f"import {module._name}"] = time.perf_counter() - start
+            except ImportError as e:
+                print(f"{module._name} not available: {e}")
+    start = time.perf_counter()
+    try:
+        pyttsx3.init()
+        deferred["init pyttsx3 engine"] = time.perf_counter() - start
+    except Exception as e:
+        print(f"TTS engine not available: {e}")
+
+    for name, seconds in timings.items():
+        print(f"{name:40} {seconds * 1000:10.1f} ms")
+    print(f"{'= to login window':40} {to_login * 1000:10.1f} ms")
+    print(f"{'= to chat window (without UI)':40} {to_chat * 1000:10.1f} ms")
+    print("Deferred until first use:")
+    for name, seconds in deferred.items():
+        print(f"{name:40} {seconds * 1000:10.1f} ms")
+    return timings, deferred
+
+STARTUP_TIMINGS["module setup"] = time.perf_counter() - _startup_clock - sum(STARTUP_TIMINGS.values())
 
 if __name__ == "__main__":
-    login_root = tk.Tk()
-    login_app = LoginApp(login_root)
-    login_root.mainloop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Online Doctor Chatbot")
+    parser.add_argument("--log-level", help="DEBUG, INFO, WARNING or ERROR (default: MEDIBOT_LOG_LEVEL or INFO)")
+    subparsers = parser.add_subparsers(dest="command")
+    packs_parser = subparsers.add_parser("build-language-packs", help="translate the questionnaire for offline use")
+    packs_parser.add_argument("languages", nargs="*", help="language names or codes (default: all)")
+    packs_parser.add_argument("--workers", type=int, default=8, help="concurrent translation requests")
+    export_parser = subparsers.add_parser("export-history", help="export stored prescriptions to PDF in bulk")
+    export_parser.add_argument("output", help="zip file, combined PDF file or folder to write")
+    export_parser.add_argument("--user", help="only this user's prescriptions (default: all users)")
+    export_parser.add_argument("--from", dest="start", help="first date to include, YYYY-MM-DD")
+    export_parser.add_argument("--to", dest="end", help="last date to include, YYYY-MM-DD")
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, default="zip", help="zip archive, one combined PDF or a folder of PDFs")
+    export_parser.add_argument("--workers", type=int, help="rendering processes (default: CPU count)")
+    serve_parser = subparsers.add_parser("serve", help="serve the intake to browsers over HTTP and WebSocket")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    serve_parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    serve_parser.add_argument("--workers", type=int, default=4, help="database worker threads")
+    bench_parser = subparsers.add_parser("benchmark", help="time the hot paths headless and write JSON results")
+    bench_parser.add_argument("--output", default="bench_results.json", help="JSON file to write")
+    bench_parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    bench_parser.add_argument("--repeat", type=int, default=5, help="timing rounds per benchmark")
+    bench_parser.add_argument("--history-sizes", type=int, nargs="+", default=[10000, 100000], help="prescription rows to page through")
+    bench_parser.add_argument("--tolerance", type=float, default=0.10, help="slowdown vs baseline reported as a regression")
+    metrics_parser = subparsers.add_parser("metrics-report", help="show p50/p95/p99 timings per stage")
+    metrics_parser.add_argument("--since", help="only include metrics recorded from this date, YYYY-MM-DD")
+    subparsers.add_parser("startup-report", help="show where start-up time goes, by component")
+    args = parser.parse_args()
+    if args.log_level:
+        configure_logging(args.log_level)
+
+    if args.command == "build-language-packs":
+        build_language_packs(args.languages, args.workers)
+    elif args.command == "startup-report":
+        startup_report()
+    elif args.command == "metrics-report":
+        metrics_report(since=args.since)
+    elif args.command == "benchmark":
+        _, regressions = run_benchmarks(args.output, args.baseline, args.repeat, args.history_sizes, tolerance=args.tolerance)
+        sys.exit(1 if regressions else 0)
+    elif args.command == "serve":
+        serve(args.host, args.port, args.workers)
+    elif args.command == "export-history":
+        export_history(args.output, args.user, args.start, args.end, args.format, args.workers)
+    else:
+        login_root = tk.Tk()
+        login_app = LoginApp(login_root)
+        login_root.mainloop()
\ No newline at end of file